@@ -1,8 +1,15 @@
 '''------------------------------------------------------------------------
 SUMMARY OF THE PROGRAM: This module moves data local VM to Azure Blob storage
 It has methods to performs following action:
-    - Initiate connection to Azure storage
-    - Copy contents of input directory from local VM to Azure Blob
+    - Initiate connection to Azure storage, shared across the process, see blobclient
+    - Copy contents of input directory and its sub directories from local VM to Azure Blob,
+      feeding the upload workers while the directory is walked
+    - Upload large files in blocks staged in parallel, resuming from the blocks already staged
+    - Skip files identical to the blob already in Azure, comparing Content-MD5
+    - Throttle uploads against the VM and source bandwidth limits, see bandwidth
+    - Adapt the number of concurrent uploads to throughput, latency and throttling of the storage account
+    - Record bytes, duration, throughput and retries of every file, see transfermetrics
+    - Stream files from source system to Azure Blob, without staging on local VM
     - Delete files from Azure blob, if requested
     
 ---------------------------------------------------------------------------------------
@@ -11,13 +18,274 @@ VERSION        Date            Comments
 PROGRAM
 ---------------------------------------------------------------------------------------
 '''
+import base64
+import json
 import logging
+import os
+import shutil
+import threading
+import time
+import Queue
 
-from os import listdir
+from os import listdir, environ
+from multiprocessing.pool import ThreadPool
 
 import codebase.dataload.cfg as cfg
-from azure.storage.blob import BlockBlobService
+from azure.common import AzureMissingResourceHttpError
+from azure.storage.blob.models import BlobBlock, ContentSettings
 import codebase.dataload.exceptions as ex
+import codebase.dataload.source.blobclient as blobclient
+import codebase.dataload.source.bandwidth as bandwidth
+import codebase.dataload.source.transfermetrics as transfermetrics
+from codebase.dataload.source.transfermanifest import computeMd5, iterFiles
+
+''' Module level variable '''
+''' Parallel connections per streamed blob; every connection holds one block in memory.
+    Keep it at 1 for sources that cannot seek '''
+STREAM_MAX_CONNECTIONS = int(environ.get('AZURE_STREAM_MAX_CONNECTIONS', 1))
+''' Files of one directory uploaded at the same time, sharing one blob client; 1 uploads them one by one '''
+UPLOAD_WORKER_COUNT = int(environ.get('AZURE_UPLOAD_WORKERS', 1))
+''' Files of at least BLOCK_UPLOAD_THRESHOLD MB are uploaded in blocks of BLOCK_SIZE MB, staged on
+    BLOCK_WORKER_COUNT threads; every thread holds one block in memory. 0 disables block upload '''
+BLOCK_UPLOAD_THRESHOLD = int(environ.get('AZURE_BLOCK_UPLOAD_MB', 0)) * 1024 * 1024
+BLOCK_SIZE = int(environ.get('AZURE_BLOCK_SIZE_MB', 16)) * 1024 * 1024
+BLOCK_WORKER_COUNT = int(environ.get('AZURE_BLOCK_WORKERS', 4))
+''' Hash every file before upload and skip it, when the blob has the same Content-MD5; 'Y' or 'N' '''
+SKIP_IDENTICAL_UPLOAD = environ.get('AZURE_SKIP_IDENTICAL', 'N').upper() == 'Y'
+''' Blobs deleted at the same time, and blobs listed per page while clearing a directory '''
+DELETE_WORKER_COUNT = int(environ.get('AZURE_DELETE_WORKERS', 1))
+LIST_PAGE_SIZE = int(environ.get('AZURE_LIST_PAGE_SIZE', 5000))
+''' Adapt concurrent uploads between AZURE_UPLOAD_MIN_WORKERS and AZURE_UPLOAD_WORKERS; 'Y' or 'N'.
+    Concurrency is reviewed every ADAPTIVE_WINDOW uploads and a file throttled by the storage
+    account is retried up to THROTTLE_RETRY_COUNT times '''
+ADAPTIVE_UPLOAD = environ.get('AZURE_UPLOAD_ADAPTIVE', 'N').upper() == 'Y'
+UPLOAD_MIN_WORKER_COUNT = int(environ.get('AZURE_UPLOAD_MIN_WORKERS', 1))
+ADAPTIVE_WINDOW = int(environ.get('AZURE_ADAPTIVE_WINDOW', 8))
+THROTTLE_RETRY_COUNT = int(environ.get('AZURE_THROTTLE_RETRIES', 3))
+''' Concurrency is lowered when latency per MB exceeds the best seen by this factor,
+    and raised while throughput improves by more than THROUGHPUT_GAIN '''
+LATENCY_BACKOFF_FACTOR = float(environ.get('AZURE_LATENCY_BACKOFF_FACTOR', 2))
+THROUGHPUT_GAIN = float(environ.get('AZURE_THROUGHPUT_GAIN', 0.1))
+
+MEGABYTE = 1024 * 1024
+
+
+class BlockJournal():
+    ''' This class records the blocks of a file staged in Azure, so an interrupted upload can resume
+        The journal is kept in a directory next to the source directory, one JSON file per source file.
+        It is keyed on the blob name and the content MD5, so it stays valid when the same file is
+        downloaded again; the directory goes with the source directory, see removeAll
+    '''
+    
+    def __init__(self, sourceDataDir, fileNm, destBlob, contentMd5):
+        ''' Loads the journal of the file; a journal of another blob or of other content is discarded
+        
+        :param str sourceDataDir: Directory location of source data
+        :param str fileNm: File path, relative to sourceDataDir
+        :param str destBlob: Target blob name
+        :param str contentMd5: base64 encoded MD5 of the file
+        :returns:
+        :raises:
+        '''
+        self.journalDir = self.getJournalDir(sourceDataDir)
+        self.journalPath = os.path.join(self.journalDir, fileNm + '.json')
+        
+        self._lock = threading.Lock()
+        self._journal = {'blob': destBlob, 'md5': contentMd5, 'blockSize': BLOCK_SIZE, 'staged': []}
+        
+        if os.path.exists(self.journalPath):
+            try:
+                with open(self.journalPath) as journalIn:
+                    journal = json.load(journalIn)
+            except (IOError, ValueError):
+                journal = {}
+            
+            if all(journal.get(key) == self._journal[key] for key in ('blob', 'md5', 'blockSize')):
+                self._journal = journal
+    
+    
+    @staticmethod
+    def getJournalDir(sourceDataDir):
+        ''' Journal directory of a source directory '''
+        return sourceDataDir.rstrip(os.sep) + '.blocks'
+    
+    
+    @staticmethod
+    def removeAll(sourceDataDir):
+        ''' Deletes the journals of a source directory, when the directory is cleaned up '''
+        journalDir = BlockJournal.getJournalDir(sourceDataDir)
+        if os.path.isdir(journalDir):
+            shutil.rmtree(journalDir)
+    
+    
+    def stagedBlocks(self):
+        ''' Block ids staged by earlier attempts '''
+        return set(self._journal['staged'])
+    
+    
+    def addBlock(self, blockId):
+        ''' Records a staged block; the journal is saved after every block '''
+        with self._lock:
+            self._journal['staged'].append(blockId)
+            if not os.path.exists(os.path.dirname(self.journalPath)):
+                os.makedirs(os.path.dirname(self.journalPath))
+            with open(self.journalPath + '.tmp', 'w') as journalOut:
+                json.dump(self._journal, journalOut)
+            os.rename(self.journalPath + '.tmp', self.journalPath)
+    
+    
+    def remove(self):
+        ''' Deletes the journal, once the block list is committed '''
+        if os.path.exists(self.journalPath):
+            os.remove(self.journalPath)
+        
+        ''' remove the journal directories left empty, up to the journal root '''
+        journalDir = os.path.dirname(self.journalPath)
+        while journalDir.startswith(self.journalDir) and os.path.isdir(journalDir) and not listdir(journalDir):
+            os.rmdir(journalDir)
+            journalDir = os.path.dirname(journalDir)
+
+
+class AdaptiveConcurrency():
+    ''' This class has methods for limiting concurrent uploads to one storage account
+        It adds a worker while throughput improves, removes one when latency rises and
+        halves the workers when the storage account throttles requests (503/ServerBusy)
+    '''
+    
+    def __init__(self, storageAccountNm, minWorkers, maxWorkers):
+        ''' Starts with the minimum number of workers
+        
+        :param str storageAccountNm: Name of storage account, for the log
+        :param int minWorkers: Minimum concurrent uploads
+        :param int maxWorkers: Maximum concurrent uploads
+        :returns:
+        :raises:
+        '''
+        self.LOGGER = logging.getLogger(__name__)
+        self.storageAccountNm = storageAccountNm
+        self.minWorkers = max(1, min(minWorkers, maxWorkers))
+        self.maxWorkers = maxWorkers
+        self.limit = self.minWorkers
+        
+        self._condition = threading.Condition()
+        self._active = 0
+        self._lastThroughput = None
+        self._bestLatency = None
+        self._resetWindow()
+    
+    
+    def run(self, uploadFunc, byteCount):
+        ''' Runs one upload once a worker slot is free and records its outcome
+            Latency is taken from the seconds the upload spent in storage requests, so bandwidth
+            limit sleeps and reads of the file do not count as a slower storage account.
+            Only successful and throttled uploads are recorded
+        
+        :param function uploadFunc: Upload to run; returns the seconds spent in storage requests
+        :param int byteCount: Bytes uploaded
+        :returns: Return value of uploadFunc
+        :raises Exception: Exception of uploadFunc
+        '''
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        
+        requestSeconds = None
+        throttled = False
+        try:
+            requestSeconds = uploadFunc()
+            return requestSeconds
+        except Exception as e:
+            throttled = self.isThrottled(e)
+            raise
+        finally:
+            with self._condition:
+                self._active -= 1
+                ''' other failures leave the window as it is '''
+                if throttled or requestSeconds is not None:
+                    self._record(byteCount, requestSeconds, throttled)
+                self._condition.notify_all()
+    
+    
+    @staticmethod
+    def isThrottled(exception):
+        ''' Checks if the storage account rejected the request as too busy '''
+        return getattr(exception, 'status_code', None) in (500, 503) or 'ServerBusy' in str(exception)
+    
+    
+    def _record(self, byteCount, seconds, throttled):
+        ''' Adds an upload to the window and reviews the limit at the end of the window '''
+        if throttled:
+            self._adjust(max(self.minWorkers, self.limit // 2), 'throttled by storage account')
+            self._lastThroughput = None
+            self._resetWindow()
+            return
+        
+        self._windowUploads += 1
+        self._windowBytes += byteCount
+        self._windowSeconds += seconds
+        
+        if self._windowUploads < ADAPTIVE_WINDOW:
+            return
+        
+        elapsed = max(time.time() - self._windowStart, 1e-6)
+        throughput = self._windowBytes / elapsed / MEGABYTE
+        latency = self._windowSeconds / max(float(self._windowBytes) / MEGABYTE, 1e-6)
+        
+        if self._bestLatency is None or latency < self._bestLatency:
+            self._bestLatency = latency
+        
+        if latency > self._bestLatency * LATENCY_BACKOFF_FACTOR:
+            self._adjust(max(self.minWorkers, self.limit - 1), 'latency rose', throughput, latency)
+        elif self._lastThroughput is None or throughput > self._lastThroughput * (1 + THROUGHPUT_GAIN):
+            self._adjust(min(self.maxWorkers, self.limit + 1), 'throughput improved', throughput, latency)
+        else:
+            self._adjust(self.limit, 'throughput flat', throughput, latency)
+        
+        self._lastThroughput = throughput
+        self._resetWindow()
+    
+    
+    def _adjust(self, limit, reason, throughput=None, latency=None):
+        ''' Sets the new limit and logs the decision '''
+        if throughput is None:
+            metrics = ''
+        else:
+            metrics = " ({:.1f} MB/s, {:.2f} s/MB)".format(throughput, latency)
+        
+        ''' decisions that change the limit are logged at info level '''
+        logLevel = logging.INFO if limit != self.limit else logging.DEBUG
+        self.LOGGER.log(logLevel, "Upload concurrency for storage account {}: {} -> {}, {}{}"
+                        .format(self.storageAccountNm, self.limit, limit, reason, metrics))
+        self.limit = limit
+    
+    
+    def _resetWindow(self):
+        ''' Starts a new review window '''
+        self._windowStart = time.time()
+        self._windowUploads = 0
+        self._windowBytes = 0
+        self._windowSeconds = 0.0
+
+
+''' Controllers per storage account, kept for the whole run '''
+_uploadControllers = {}
+_uploadControllersLock = threading.Lock()
+
+
+def getUploadController(storageAccountNm):
+    ''' Returns the adaptive concurrency controller of the storage account
+    
+    :param str storageAccountNm: Name of storage account
+    :returns obj controller: AdaptiveConcurrency instance
+    :raises:
+    '''
+    with _uploadControllersLock:
+        if storageAccountNm not in _uploadControllers:
+            _uploadControllers[storageAccountNm] = AdaptiveConcurrency(storageAccountNm,
+                                                                       UPLOAD_MIN_WORKER_COUNT,
+                                                                       UPLOAD_WORKER_COUNT)
+        return _uploadControllers[storageAccountNm]
 
 
 class AzureLoad():
@@ -32,27 +300,30 @@ class AzureLoad():
         self.LOGGER = logging.getLogger(__name__)
         
         
-    def transferFromVMToAzure(self, storageAccountNm, storageAccountKey, loadDataCntnr, sourceDataDir, destDataDir):
+    def transferFromVMToAzure(self, storageAccountNm, storageAccountKey, loadDataCntnr, sourceDataDir, destDataDir,
+                              skipFiles=None, onUploaded=None, sourceNm=None, metricsTags=None):
         ''' Copy files from local to Azure Blob storage
-        
+
         :param str storageAccountNm: Name of storage account
         :parm str storageAccountKey: Storage account key
         :parm str loadDataCntnr: Load Data Container
         :parm str sourceDataDir: Directory location of source data
         :parm str destDataDir: Directory of target data
-        
-        :returns:
-        
-        :raises Exception DataloadApplicationException: Error while connecting to blob storage 
-        '''    
-        ''' List all the files in the input directory on VM '''
-        listAllFile = listdir(sourceDataDir)
-        fileCounter = 0
-        
+        :parm set skipFiles: Files already uploaded by an earlier run, see transfermanifest
+        :parm function onUploaded: Called with the file path, relative to sourceDataDir, after every
+                                   successful upload
+        :parm str sourceNm: Source environment name, for the bandwidth limit of the source
+        :parm dict metricsTags: Tags added to the metrics of every file, e.g. feed id and date
+
+        :returns int fileCounter: Number of files uploaded
+
+        :raises Exception DataloadApplicationException: Error while connecting to blob storage
+                                                        or uploading a file; uploadedFiles attribute
+                                                        lists the files uploaded before the failure
+        '''
         try:
             ''' connect to the Azure Blob storage account'''        
-            blobConnect = BlockBlobService(account_name=storageAccountNm,
-                                           account_key=storageAccountKey)
+            blobConnect = blobclient.getBlobService(storageAccountNm, storageAccountKey)
         except Exception as e:
             errorMsg = cfg.err.getErrorMsg('AZR_CONNECTION_ERR')
             errorMsg = errorMsg.format(type(e), str(e))
@@ -60,25 +331,279 @@ class AzureLoad():
         else:
             self.LOGGER.debug ("connected to Blob Storage - {} container - {}".format(storageAccountNm, loadDataCntnr))
 
+        uploadedFiles = []
+        skippedFiles = []
+        failedFiles = []
+        resultLock = threading.Lock()
+        stopEvent = threading.Event()
+        uploadController = getUploadController(storageAccountNm) if ADAPTIVE_UPLOAD else None
+        metricsTags = dict(metricsTags or {}, sourceNm=sourceNm)
+        
+        def checkIdenticalBlob(fileNm):
+            ''' hashes one file and compares it with the blob, when identical uploads are skipped
+                returns True, if the blob is identical, and the content settings of the upload '''
+            if not SKIP_IDENTICAL_UPLOAD:
+                return False, None
+            
+            ''' hash once; the same MD5 is stored on the blob for the next comparison '''
+            destBlob = destDataDir + fileNm
+            contentMd5 = computeMd5(sourceDataDir + fileNm)
+            identicalBlob = self.isIdenticalBlob(blobConnect, loadDataCntnr, destBlob, contentMd5)
+            if identicalBlob:
+                self.LOGGER.debug("Skipping File= {}, identical to blob= {}".format(fileNm, destBlob))
+            return identicalBlob, ContentSettings(content_md5=contentMd5)
+        
+        def putFile(fileNm, fileSize, contentSettings):
+            ''' uploads one file; returns the seconds spent in storage requests '''
+            sourceFile = sourceDataDir + fileNm
+            destBlob = destDataDir + fileNm
+            self.LOGGER.debug ("Uploading File= {} from source= {} as blob= {}"
+                          .format(fileNm, sourceDataDir, destBlob)) 
+            
+            if BLOCK_UPLOAD_THRESHOLD and fileSize >= BLOCK_UPLOAD_THRESHOLD:
+                return self.transferFileInBlocks(blobConnect, loadDataCntnr, sourceDataDir, fileNm, destBlob,
+                                                 contentSettings, sourceNm)
+            
+            startTime = time.time()
+            if bandwidth.limiter.isEnabled():
+                ''' the limit is drawn read by read while the client sends the file '''
+                with open(sourceFile, 'rb') as fileIn:
+                    throttledFile = bandwidth.ThrottledReader(fileIn, sourceNm)
+                    blobConnect.create_blob_from_stream(loadDataCntnr,
+                                                        destBlob,
+                                                        throttledFile,
+                                                        count=fileSize,
+                                                        content_settings=contentSettings,
+                                                        validate_content=True)
+                return max(0.0, time.time() - startTime - throttledFile.waitSeconds)
+            
+            blobConnect.create_blob_from_path(loadDataCntnr,
+                                              destBlob, 
+                                              sourceFile,
+                                              content_settings=contentSettings,
+                                              validate_content=True)
+            return time.time() - startTime
+        
+        def uploadFile(fileNm, fileSize):
+            ''' uploads one file; files not started yet are skipped after the first failure '''
+            if stopEvent.is_set():
+                return
+            
+            sourceFile = sourceDataDir + fileNm
+            throttleRetries = 0
+            startTime = time.time()
+            identicalBlob = None
+            
+            while True:
+                try:
+                    ''' hashing and skipped files stay out of the concurrency slots and their timing '''
+                    if identicalBlob is None:
+                        identicalBlob, contentSettings = checkIdenticalBlob(fileNm)
+                    if identicalBlob:
+                        break
+                    if uploadController:
+                        uploadController.run(lambda: putFile(fileNm, fileSize, contentSettings), fileSize)
+                    else:
+                        putFile(fileNm, fileSize, contentSettings)
+                except Exception as e:
+                    if uploadController and uploadController.isThrottled(e) and throttleRetries < THROTTLE_RETRY_COUNT:
+                        ''' concurrency is already lowered; try again after a pause '''
+                        throttleRetries += 1
+                        self.LOGGER.warning("Retrying {} throttled by storage account, attempt {}"
+                                            .format(sourceFile, throttleRetries))
+                        time.sleep(throttleRetries)
+                        continue
+                    
+                    stopEvent.set()
+                    with resultLock:
+                        failedFiles.append((sourceFile, e))
+                    transfermetrics.record('upload', fileNm, fileSize, time.time() - startTime,
+                                           throttleRetries, 'FAILED', **metricsTags)
+                    return
+                break
+            
+            transfermetrics.record('upload', fileNm, 0 if identicalBlob else fileSize,
+                                   time.time() - startTime, throttleRetries, 'SKIPPED' if identicalBlob else 'SUCCESS',
+                                   **metricsTags)
+            
+            with resultLock:
+                if identicalBlob:
+                    skippedFiles.append(fileNm)
+                else:
+                    uploadedFiles.append(fileNm)
+            
+            if onUploaded:
+                onUploaded(fileNm)
+        
+        def uploadWorker():
+            ''' uploads the files queued by the directory walk, until the end of the queue '''
+            while True:
+                queuedFile = fileQueue.get()
+                if queuedFile is None:
+                    return
+                try:
+                    uploadFile(*queuedFile)
+                except Exception as e:
+                    stopEvent.set()
+                    with resultLock:
+                        failedFiles.append((sourceDataDir + queuedFile[0], e))
+        
+        ''' the queue is bounded, so the walk never runs far ahead of the uploads '''
+        fileQueue = Queue.Queue(maxsize=UPLOAD_WORKER_COUNT * 2)
+        uploadWorkers = []
+        if UPLOAD_WORKER_COUNT > 1:
+            for workerNo in range(UPLOAD_WORKER_COUNT):
+                workerThread = threading.Thread(target=uploadWorker, name='upload-{}'.format(workerNo))
+                workerThread.daemon = True
+                workerThread.start()
+                uploadWorkers.append(workerThread)
+        
+        fileCount = 0
+        skippedByManifest = 0
         try:
-            ''' move each file sequentially from VM to Azure Blob storage '''
-            for fileNm in listAllFile:
-                sourceFile = sourceDataDir + fileNm
-                destBlob = destDataDir + fileNm
-                self.LOGGER.debug ("Uploading File= {} from source= {} as blob= {}"
-                              .format(fileNm, sourceDataDir, destBlob)) 
-                              
-                blobConnect.create_blob_from_path(loadDataCntnr,
-                                                  destBlob, 
-                                                  sourceFile,
-                                                  validate_content=True)
-                fileCounter += 1
-        except Exception as e:
+            ''' walk the input directory on VM and move each file to Azure Blob storage,
+                concurrently or one by one '''
+            for fileNm, fileSize in iterFiles(sourceDataDir):
+                if stopEvent.is_set():
+                    break
+                if skipFiles and fileNm in skipFiles:
+                    skippedByManifest += 1
+                    continue
+                
+                fileCount += 1
+                if uploadWorkers:
+                    fileQueue.put((fileNm, fileSize))
+                else:
+                    uploadFile(fileNm, fileSize)
+        except (IOError, OSError) as e:
+            stopEvent.set()
+            with resultLock:
+                failedFiles.append((sourceDataDir, e))
+        finally:
+            for workerThread in uploadWorkers:
+                fileQueue.put(None)
+            for workerThread in uploadWorkers:
+                workerThread.join()
+        
+        if skippedByManifest:
+            self.LOGGER.info("Skipped {} files already uploaded to blob - {}".format(skippedByManifest, destDataDir))
+        
+        if failedFiles:
+            sourceFile, e = failedFiles[0]
             errorMsg = cfg.err.getErrorMsg('AZR_FILE_LOAD_ERR')
             errorMsg = errorMsg.format(sourceFile, type(e), str(e))
-            raise ex.DataloadApplicationException(errorMsg)
+            
+            self.LOGGER.error("Uploaded {} of {} files to blob - {} before failure: {}"
+                              .format(len(uploadedFiles), fileCount, destDataDir, sorted(uploadedFiles)))
+            for sourceFile, e in failedFiles[1:]:
+                self.LOGGER.error("Failed to upload {} {}".format(sourceFile, str(e)))
+            
+            dae = ex.DataloadApplicationException(errorMsg)
+            dae.uploadedFiles = sorted(uploadedFiles)
+            dae.skippedFiles = sorted(skippedFiles)
+            raise dae
         
-        return fileCounter
+        if skippedFiles:
+            self.LOGGER.info("Uploaded {} files, skipped {} files identical to blobs in - {}"
+                             .format(len(uploadedFiles), len(skippedFiles), destDataDir))
+        
+        return len(uploadedFiles)
+    
+    
+    def isIdenticalBlob(self, blobConnect, loadDataCntnr, destBlob, contentMd5):
+        ''' Checks if the blob exists with the given Content-MD5
+        
+        :param obj blobConnect: Blob storage connection
+        :parm str loadDataCntnr: Load Data Container
+        :parm str destBlob: Target blob name
+        :parm str contentMd5: base64 encoded MD5 of the local file
+        
+        :returns boolean: True, if the upload can be skipped
+        
+        :raises:
+        '''
+        try:
+            blobProperties = blobConnect.get_blob_properties(loadDataCntnr, destBlob).properties
+        except Exception as e:
+            ''' missing blob, or no permission to read it; the file is uploaded '''
+            self.LOGGER.debug("Cannot get properties of blob {}. {}".format(destBlob, str(e)))
+            return False
+        
+        return blobProperties.content_settings.content_md5 == contentMd5
+    
+    
+    def transferFileInBlocks(self, blobConnect, loadDataCntnr, sourceDataDir, fileNm, destBlob, contentSettings=None,
+                             sourceNm=None):
+        ''' Upload one file as blocks staged in parallel and commit them with a block list
+            Blocks recorded in the journal and still uncommitted in Azure are not staged again
+        
+        :param obj blobConnect: Blob storage connection
+        :parm str loadDataCntnr: Load Data Container
+        :parm str sourceDataDir: Directory location of source data
+        :parm str fileNm: File name
+        :parm str destBlob: Target blob name
+        :parm obj contentSettings: Content settings of the committed blob; the MD5 is computed when not set
+        :parm str sourceNm: Source environment name, for the bandwidth limit of the source
+        
+        :returns float: Seconds spent in storage requests, summed over the blocks
+        
+        :raises Exception: Error while staging or committing blocks; the journal is kept for the next attempt
+        '''
+        sourceFile = os.path.join(sourceDataDir, fileNm)
+        
+        ''' the committed blob gets the MD5 too, so identical uploads can be skipped later '''
+        if contentSettings is None or not contentSettings.content_md5:
+            contentSettings = ContentSettings(content_md5=computeMd5(sourceFile))
+        journal = BlockJournal(sourceDataDir, fileNm, destBlob, contentSettings.content_md5)
+        
+        fileSize = os.path.getsize(sourceFile)
+        blockCount = max(1, (fileSize + BLOCK_SIZE - 1) // BLOCK_SIZE)
+        
+        ''' block ids must have the same length within a blob '''
+        blockIds = [base64.b64encode('{:08d}'.format(index)) for index in range(blockCount)]
+        
+        stagedBlocks = journal.stagedBlocks()
+        if stagedBlocks:
+            ''' uncommitted blocks expire in Azure; only resume from the ones still there '''
+            try:
+                blockList = blobConnect.get_block_list(loadDataCntnr, destBlob, block_list_type='uncommitted')
+                stagedBlocks &= set(block.id for block in blockList.uncommitted_blocks)
+            except Exception as e:
+                self.LOGGER.debug("Cannot list uncommitted blocks of blob {}. {}".format(destBlob, str(e)))
+                stagedBlocks = set()
+            
+            self.LOGGER.info("Resuming upload of {} from block {} of {}".format(sourceFile, len(stagedBlocks), blockCount))
+        
+        def stageBlock(index):
+            ''' reads one block of the file and stages it; returns the seconds of the request '''
+            with open(sourceFile, 'rb') as fileIn:
+                fileIn.seek(index * BLOCK_SIZE)
+                block = fileIn.read(BLOCK_SIZE)
+            
+            bandwidth.throttle(len(block), sourceNm)
+            startTime = time.time()
+            blobConnect.put_block(loadDataCntnr, destBlob, block, blockIds[index], validate_content=True)
+            requestSeconds = time.time() - startTime
+            journal.addBlock(blockIds[index])
+            return requestSeconds
+        
+        pendingBlocks = [index for index in range(blockCount) if blockIds[index] not in stagedBlocks]
+        
+        blockPool = ThreadPool(max(1, min(BLOCK_WORKER_COUNT, len(pendingBlocks))))
+        try:
+            requestSeconds = sum(blockPool.map(stageBlock, pendingBlocks))
+        finally:
+            blockPool.close()
+            blockPool.join()
+        
+        startTime = time.time()
+        blobConnect.put_block_list(loadDataCntnr, destBlob, [BlobBlock(id=blockId) for blockId in blockIds],
+                                   content_settings=contentSettings)
+        requestSeconds += time.time() - startTime
+        journal.remove()
+        
+        self.LOGGER.debug("Committed {} blocks of {} as blob= {}".format(blockCount, sourceFile, destBlob))
+        return requestSeconds
     
     
     def clearFileFromAzure(self, storageAccountNm, storageAccountKey, loadDataCntnr, destDataDir):
@@ -89,37 +614,139 @@ class AzureLoad():
         :parm str loadDataCntnr: Load Data Container
         :parm str destDataDir: Target directory
         
-        :returns:
+        :returns tuple: Number of blobs deleted, already missing and failed to delete
         
         :raises Exception DataloadApplicationException: Error while connecting to blob storage
+                                                        or deleting a blob
         '''
         
         try:
             ''' connect to the Azure Blob storage account'''        
-            blobConnect = BlockBlobService(account_name=storageAccountNm,
-                                            account_key=storageAccountKey)
+            blobConnect = blobclient.getBlobService(storageAccountNm, storageAccountKey)
         except Exception as e:
             errorMsg = cfg.err.getErrorMsg('AZR_CONNECTION_ERR')
             errorMsg = errorMsg.format(type(e), str(e))
             raise ex.DataloadApplicationException(errorMsg)
         
+        deleteCounts = {'deleted': 0, 'missing': 0, 'failed': 0}
+        failedBlobs = []
+        countLock = threading.Lock()
+        
+        def deleteBlob(blobNm):
+            ''' deletes one blob; a blob deleted by someone else is counted as missing '''
+            try:
+                blobConnect.delete_blob(loadDataCntnr, blobNm)
+            except AzureMissingResourceHttpError:
+                deleteResult = 'missing'
+            except Exception as e:
+                deleteResult = 'failed'
+                with countLock:
+                    failedBlobs.append((blobNm, e))
+            else:
+                deleteResult = 'deleted'
+                self.LOGGER.debug("Deleted blob {}".format(blobNm))
+            
+            with countLock:
+                deleteCounts[deleteResult] += 1
+        
+        deletePool = ThreadPool(DELETE_WORKER_COUNT) if DELETE_WORKER_COUNT > 1 else None
+        marker = None
+        
         try:
-            ''' Get list of all file at a give path, in Azure Blob '''               
-            listAllFile = blobConnect.list_blobs(container_name=loadDataCntnr, prefix=destDataDir)
+            while True:
+                try:
+                    ''' Get one page of the files at a give path, in Azure Blob '''
+                    blobPage = blobConnect.list_blobs(container_name=loadDataCntnr, prefix=destDataDir,
+                                                      num_results=LIST_PAGE_SIZE, marker=marker)
+                    blobNames = [val.name for val in blobPage]
+                except Exception as e:
+                    errorMsg = cfg.err.getErrorMsg('AZR_FILE_LIST_ERR')
+                    errorMsg = errorMsg.format(destDataDir, type(e), str(e))
+                    raise ex.DataloadApplicationException(errorMsg)
+                
+                ''' Delete files of the page from Azure Blob Storage '''
+                if deletePool:
+                    deletePool.map(deleteBlob, blobNames)
+                else:
+                    for blobNm in blobNames:
+                        deleteBlob(blobNm)
+                
+                marker = getattr(blobPage, 'next_marker', None)
+                if not marker:
+                    break
+        finally:
+            if deletePool:
+                deletePool.close()
+                deletePool.join()
+        
+        self.LOGGER.info("Cleared blob - {}: {} deleted, {} missing, {} failed"
+                         .format(destDataDir, deleteCounts['deleted'], deleteCounts['missing'], deleteCounts['failed']))
+        
+        if failedBlobs:
+            blobNm, e = failedBlobs[0]
+            errorMsg = cfg.err.getErrorMsg('AZR_FILE_DELETE_ERR')
+            errorMsg = errorMsg.format(blobNm, type(e), str(e))
+            raise ex.DataloadApplicationException(errorMsg)
+        
+        return deleteCounts['deleted'], deleteCounts['missing'], deleteCounts['failed']
+            
             
+    def transferStreamToAzure(self, storageAccountNm, storageAccountKey, loadDataCntnr, feedStreams, destDataDir,
+                              sourceNm=None, metricsTags=None):
+        ''' Copy files from source streams to Azure Blob storage, block by block
+            Only one block per connection is held in memory; nothing is written to local VM
+        
+        :param str storageAccountNm: Name of storage account
+        :parm str storageAccountKey: Storage account key
+        :parm str loadDataCntnr: Load Data Container
+        :parm iterable feedStreams: (file name, file like object) pairs returned by the source module
+        :parm str destDataDir: Directory of target data
+        :parm str sourceNm: Source environment name, for the bandwidth limit of the source
+        :parm dict metricsTags: Tags added to the metrics of every file, e.g. feed id and date
+        
+        :returns int fileCounter: Number of files uploaded
+        
+        :raises Exception DataloadApplicationException: Error while connecting to blob storage 
+        '''
+        fileCounter = 0
+        fileNm = None
+        metricsTags = dict(metricsTags or {}, sourceNm=sourceNm)
+        
+        try:
+            ''' connect to the Azure Blob storage account'''        
+            blobConnect = blobclient.getBlobService(storageAccountNm, storageAccountKey)
         except Exception as e:
-            errorMsg = cfg.err.getErrorMsg('AZR_FILE_LIST_ERR')
-            errorMsg = errorMsg.format(destDataDir, type(e), str(e))
+            errorMsg = cfg.err.getErrorMsg('AZR_CONNECTION_ERR')
+            errorMsg = errorMsg.format(type(e), str(e))
             raise ex.DataloadApplicationException(errorMsg)
-            
+        else:
+            self.LOGGER.debug ("connected to Blob Storage - {} container - {}".format(storageAccountNm, loadDataCntnr))
+
         try:
-            ''' Delete file from Azure Blob Storage ''' 
-            for val in listAllFile:
-                blobConnect.delete_blob(loadDataCntnr, val.name)
-                self.LOGGER.debug("Deleted blob {}".format(val.name)) 
-            
+            ''' pipe each source stream into a block blob '''
+            for fileNm, sourceStream in feedStreams:
+                destBlob = destDataDir + fileNm
+                self.LOGGER.debug ("Streaming File= {} as blob= {}".format(fileNm, destBlob))
+                
+                throttledStream = bandwidth.ThrottledReader(sourceStream, sourceNm)
+                streamStatus = 'FAILED'
+                startTime = time.time()
+                try:
+                    blobConnect.create_blob_from_stream(loadDataCntnr,
+                                                        destBlob,
+                                                        throttledStream,
+                                                        max_connections=STREAM_MAX_CONNECTIONS,
+                                                        validate_content=True)
+                    streamStatus = 'SUCCESS'
+                finally:
+                    if hasattr(sourceStream, 'close'):
+                        sourceStream.close()
+                    transfermetrics.record('stream', fileNm, throttledStream.bytesRead, time.time() - startTime,
+                                           status=streamStatus, **metricsTags)
+                fileCounter += 1
         except Exception as e:
-            errorMsg = cfg.err.getErrorMsg('AZR_FILE_DELETE_ERR')
-            errorMsg = errorMsg.format(val, type(e), str(e))
+            errorMsg = cfg.err.getErrorMsg('AZR_FILE_LOAD_ERR')
+            errorMsg = errorMsg.format(fileNm, type(e), str(e))
             raise ex.DataloadApplicationException(errorMsg)
-            
+        
+        return fileCounter
@@ -0,0 +1,242 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: This module limits the network bandwidth of file transfers
+It has methods to performs following action:
+    - Token bucket shared by all getfiles runs on the VM, kept in a locked state file
+    - Token bucket per source, shared by the threads of the run
+    - Report bytes transferred and time spent throttled
+
+Uploads to Azure draw from the buckets as the file is read. Source modules own their
+sockets, so downloads are charged once finished and delay the next transfer instead
+---------------------------------------------------------------------------------------
+VERSION        Date            Comments
+---------------------------------------------------------------------------------------
+PROGRAM
+---------------------------------------------------------------------------------------
+'''
+import fcntl
+import json
+import logging
+import threading
+import time
+
+from os import environ
+
+''' Module level variable '''
+''' Bandwidth of all runs on the VM, in MB per second; 0 is unlimited '''
+VM_LIMIT_MBPS = float(environ.get('TRANSFER_VM_LIMIT_MBPS', 0))
+''' Bandwidth per source environment, in MB per second, e.g. 'KRUX=40,DCM=10' '''
+SOURCE_LIMIT_MBPS = environ.get('TRANSFER_SOURCE_LIMIT_MBPS', '')
+''' Seconds of bandwidth a bucket can save up for a burst '''
+BURST_SECONDS = float(environ.get('TRANSFER_BURST_SECONDS', 1))
+''' State file of the VM wide bucket '''
+VM_BUCKET_FILE = environ.get('TRANSFER_VM_BUCKET_FILE', '/tmp/dataload_bandwidth.json')
+
+MEGABYTE = 1024 * 1024
+
+
+class TokenBucket():
+    ''' This class has methods for a token bucket shared by the threads of the process
+        A transfer larger than the bucket runs into debt; the next transfer waits for it
+    '''
+
+    def __init__(self, rateBytes, burstBytes):
+        ''' Starts with a full bucket
+
+        :param float rateBytes: Bytes added to the bucket per second
+        :param float burstBytes: Bucket size
+        :returns:
+        :raises:
+        '''
+        self.rateBytes = rateBytes
+        self.burstBytes = burstBytes
+
+        self._lock = threading.Lock()
+        self._tokens = burstBytes
+        self._updated = time.time()
+
+
+    def consume(self, byteCount):
+        ''' Takes byteCount tokens and waits until the bucket is out of debt
+
+        :param int byteCount: Bytes about to be transferred
+        :returns float waitSeconds: Time spent throttled
+        :raises:
+        '''
+        with self._lock:
+            self._tokens, self._updated = self._refill(self._tokens, self._updated, byteCount)
+            waitSeconds = max(0.0, -self._tokens / self.rateBytes)
+
+        if waitSeconds:
+            time.sleep(waitSeconds)
+        return waitSeconds
+
+
+    def _refill(self, tokens, updated, byteCount):
+        ''' Adds the tokens earned since the last update and takes byteCount '''
+        now = time.time()
+        tokens = min(self.burstBytes, tokens + (now - updated) * self.rateBytes)
+        return tokens - byteCount, now
+
+
+class SharedTokenBucket(TokenBucket):
+    ''' This class has methods for a token bucket shared by all processes on the VM
+        The bucket state is kept in a file, updated under an exclusive lock
+    '''
+
+    def __init__(self, rateBytes, burstBytes, stateFile):
+        ''' Keeps the state file path; the bucket is created on first use
+
+        :param float rateBytes: Bytes added to the bucket per second
+        :param float burstBytes: Bucket size
+        :param str stateFile: State file path
+        :returns:
+        :raises:
+        '''
+        TokenBucket.__init__(self, rateBytes, burstBytes)
+        self.stateFile = stateFile
+
+
+    def consume(self, byteCount):
+        ''' Takes byteCount tokens from the VM wide bucket, see TokenBucket.consume '''
+        with self._lock:
+            with open(self.stateFile, 'a+') as stateIo:
+                fcntl.flock(stateIo, fcntl.LOCK_EX)
+                try:
+                    stateIo.seek(0)
+                    try:
+                        state = json.loads(stateIo.read())
+                        tokens, updated = state['tokens'], state['updated']
+                    except (ValueError, KeyError, TypeError):
+                        tokens, updated = self.burstBytes, time.time()
+
+                    tokens, updated = self._refill(tokens, updated, byteCount)
+
+                    stateIo.seek(0)
+                    stateIo.truncate()
+                    stateIo.write(json.dumps({'tokens': tokens, 'updated': updated}))
+                    stateIo.flush()
+                finally:
+                    fcntl.flock(stateIo, fcntl.LOCK_UN)
+
+            waitSeconds = max(0.0, -tokens / self.rateBytes)
+
+        if waitSeconds:
+            time.sleep(waitSeconds)
+        return waitSeconds
+
+
+class BandwidthLimiter():
+    ''' This class has methods for throttling transfers against the VM and source limits '''
+
+    def __init__(self, vmLimitMbps=VM_LIMIT_MBPS, sourceLimitMbps=SOURCE_LIMIT_MBPS):
+        ''' Creates the buckets of the configured limits
+
+        :param float vmLimitMbps: Bandwidth of all runs on the VM, in MB per second
+        :param str sourceLimitMbps: Bandwidth per source environment, 'SOURCE=MBPS,...'
+        :returns:
+        :raises ValueError: Invalid limit
+        '''
+        self.LOGGER = logging.getLogger(__name__)
+
+        self.vmBucket = None
+        if vmLimitMbps > 0:
+            self.vmBucket = SharedTokenBucket(vmLimitMbps * MEGABYTE, vmLimitMbps * MEGABYTE * BURST_SECONDS,
+                                              VM_BUCKET_FILE)
+
+        self.sourceBuckets = {}
+        for sourceLimit in sourceLimitMbps.split(','):
+            if sourceLimit.strip():
+                sourceNm, limitMbps = sourceLimit.split('=')
+                limitMbps = float(limitMbps)
+                self.sourceBuckets[sourceNm.strip().upper()] = TokenBucket(limitMbps * MEGABYTE,
+                                                                           limitMbps * MEGABYTE * BURST_SECONDS)
+
+        self._statsLock = threading.Lock()
+        self._stats = {}
+
+
+    def isEnabled(self):
+        ''' Checks if any limit is configured '''
+        return bool(self.vmBucket or self.sourceBuckets)
+
+
+    def throttle(self, byteCount, sourceNm=None, direction='upload'):
+        ''' Draws byteCount from the VM bucket and the bucket of the source
+
+        :param int byteCount: Bytes about to be, or just, transferred
+        :param str sourceNm: Source environment name
+        :param str direction: 'upload' or 'download', for the report
+        :returns float waitSeconds: Time spent throttled
+        :raises:
+        '''
+        if not byteCount or not self.isEnabled():
+            return 0.0
+
+        waitSeconds = 0.0
+        sourceBucket = self.sourceBuckets.get((sourceNm or '').upper())
+
+        if sourceBucket:
+            waitSeconds += sourceBucket.consume(byteCount)
+        if self.vmBucket:
+            waitSeconds += self.vmBucket.consume(byteCount)
+
+        with self._statsLock:
+            statKey = (sourceNm, direction)
+            byteTotal, waitTotal = self._stats.get(statKey, (0, 0.0))
+            self._stats[statKey] = (byteTotal + byteCount, waitTotal + waitSeconds)
+
+        return waitSeconds
+
+
+    def report(self):
+        ''' Logs bytes transferred and time spent throttled, per source and direction '''
+        with self._statsLock:
+            stats = sorted(self._stats.items())
+
+        for (sourceNm, direction), (byteTotal, waitTotal) in stats:
+            self.LOGGER.info("Bandwidth limiter: {} {} MB {}, {:.1f} seconds throttled"
+                             .format(sourceNm, round(float(byteTotal) / MEGABYTE, 1), direction, waitTotal))
+
+
+class ThrottledReader():
+    ''' This class wraps a file like object, throttles every read and counts the bytes read and time throttled '''
+
+    def __init__(self, stream, sourceNm=None):
+        ''' Wraps the stream
+
+        :param obj stream: File like object
+        :param str sourceNm: Source environment name
+        :returns:
+        :raises:
+        '''
+        self._stream = stream
+        self._sourceNm = sourceNm
+        self.bytesRead = 0
+        self.waitSeconds = 0.0
+
+
+    def read(self, size=-1):
+        ''' Reads from the stream and draws the bytes read from the limiter '''
+        data = self._stream.read(size)
+        self.bytesRead += len(data)
+        self.waitSeconds += limiter.throttle(len(data), self._sourceNm)
+        return data
+
+
+    def __getattr__(self, name):
+        ''' seek, tell, close and the rest go to the wrapped stream '''
+        return getattr(self._stream, name)
+
+
+''' Process wide limiter shared by getfiles and AzureLoad '''
+limiter = BandwidthLimiter()
+
+
+def throttle(byteCount, sourceNm=None, direction='upload'):
+    ''' Draws from the process wide limiter, see BandwidthLimiter.throttle '''
+    return limiter.throttle(byteCount, sourceNm, direction)
+
+
+def report():
+    ''' Logs the statistics of the process wide limiter, see BandwidthLimiter.report '''
+    limiter.report()
@@ -0,0 +1,60 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: This module shares Azure Blob storage clients across the process
+It has methods to performs following action:
+    - Create one BlockBlobService per storage account, on first use
+    - Reuse its HTTP connection pool in getfiles, AzureLoad and dataload
+
+---------------------------------------------------------------------------------------
+VERSION        Date            Comments
+---------------------------------------------------------------------------------------
+PROGRAM
+---------------------------------------------------------------------------------------
+'''
+import logging
+import threading
+
+from os import environ
+
+import requests
+from requests.adapters import HTTPAdapter
+from azure.storage.blob import BlockBlobService
+
+''' Module level variable '''
+''' HTTP connections kept open per storage account; size it to the number of concurrent
+    uploads, block uploads and deletes of the run '''
+BLOB_POOL_SIZE = int(environ.get('AZURE_BLOB_POOL_SIZE', 10))
+
+LOGGER = logging.getLogger(__name__)
+
+_blobServices = {}
+_blobServicesLock = threading.Lock()
+
+
+def getBlobService(storageAccountNm, storageAccountKey):
+    ''' Returns the process wide blob client of the storage account
+
+    :param str storageAccountNm: Name of storage account
+    :param str storageAccountKey: Storage account key
+    :returns obj blobService: BlockBlobService instance
+    :raises Exception: Error while creating the client
+    '''
+    blobKey = (storageAccountNm, storageAccountKey)
+
+    with _blobServicesLock:
+        blobService = _blobServices.get(blobKey)
+
+        if blobService is None:
+            requestSession = requests.Session()
+            httpAdapter = HTTPAdapter(pool_connections=BLOB_POOL_SIZE, pool_maxsize=BLOB_POOL_SIZE)
+            requestSession.mount('https://', httpAdapter)
+            requestSession.mount('http://', httpAdapter)
+
+            blobService = BlockBlobService(account_name=storageAccountNm,
+                                           account_key=storageAccountKey,
+                                           request_session=requestSession)
+            _blobServices[blobKey] = blobService
+
+            LOGGER.debug("Created blob client for storage account - {} with {} connections"
+                         .format(storageAccountNm, BLOB_POOL_SIZE))
+
+    return blobService
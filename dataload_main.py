@@ -20,21 +20,46 @@
 '''
 ''' python libraries '''
 import commands
+import copy
 import math
 import datetime as dt
+import re
 import string
+''' imported up front; the lazy import of the first strptime call is not thread safe in python 2 '''
+import _strptime
+
+from multiprocessing.pool import ThreadPool
+from os import environ
 
 ''' application libraries'''    
 import codebase.dataload.cfg as cfg
 from codebase.dataload.env import ArgParser
 from codebase.dataload.log import ABILogger
 import codebase.dataload.util as util
+import codebase.dataload.source.runstat as runstat
+import codebase.dataload.source.blobclient as blobclient
+import codebase.dataload.source.hiveexecutor as hiveexecutor
+import codebase.dataload.source.orcstats as orcstats
 import codebase.dataload.exceptions as ex
 from codebase.dataload.constant import DB_NULL, STATUS_SUCCESS, STATUS_FAILED, STATUS_STARTED #,PGM_CLASSPATH
-from azure.storage.blob import BlockBlobService
 from codebase.dataload.processor.postprocess.Archive import Archive
 from codebase.dataload.azureutils import AzureUtils
+from azure.common import AzureException
+
 
+''' Module level variable '''
+''' Partitions registered per ALTER TABLE statement of the temp table '''
+PARTITION_BATCH_SIZE = int(environ.get('DATALOAD_PARTITION_BATCH_SIZE', 100))
+''' Load all pending dates of a feed with one dynamic partition insert; a failure reloads them date by date '''
+MULTI_DATE_LOAD = environ.get('DATALOAD_MULTI_DATE_LOAD', 'N').upper() == 'Y'
+''' Main hive tables loaded at the same time; 1 loads the feeds one after the other '''
+FEED_WORKER_COUNT = int(environ.get('DATALOAD_FEED_WORKERS', 1))
+''' Record the main table row count of every loaded date in APP_RUN_STAT '''
+COUNT_LOADED_ROWS = environ.get('DATALOAD_COUNT_ROWS', 'N').upper() == 'Y'
+''' ORC footers of the main table read at the same time while counting rows '''
+FOOTER_WORKER_COUNT = int(environ.get('DATALOAD_FOOTER_WORKERS', 8))
+''' filedate values of the footer statistics that can be matched to the dates loaded '''
+FILEDATE_PATTERN = re.compile(r'^\d{8}$')
 
 ''' instantiating global methods '''
 
@@ -57,6 +82,7 @@ class Dataload():
         self.processName = args.processName
         
         self.executionId = 0
+        self.failedPartitionCount = 0
 
         LOGGER = ABILogger('codebase.dataload.source.dataload',logFileName=self.sourceEnv)
         self.LOGGER = LOGGER
@@ -88,24 +114,25 @@ class Dataload():
         :param int processID: process id
         :param date execStartDt: execution start date
         :param str statusCd: status code
-        :returns :
+        :returns : execution id; None for success entries, which are queued and written in batches
         :raises DataloadSystemException: Exceptions while deleting data from directory
         '''
         self.LOGGER.debug("Set execution id")
         try:
-            executionId = util.logRunStat(result.source_id,
-                                          result.feed_id,
-                                          processID,
-                                          self.workflowId,
-                                          execDt,
-                                          statusCd,
-                                          post_run_ct,
-                                          eligible_next_run,execution_id )
+            executionId = runstat.logRunStat(result.source_id,
+                                             result.feed_id,
+                                             processID,
+                                             self.workflowId,
+                                             execDt,
+                                             statusCd,
+                                             post_run_ct,
+                                             eligible_next_run,execution_id,
+                                             deferred=(statusCd == STATUS_SUCCESS))
             
         except ex.DataloadApplicationException as dae:
             erorrCd, errorMsg = cfg.err.getErrorCd('DATALOAD_SET_EXECID_ERR')
             errorMsg = errorMsg.format(dae.message)
-            raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
+            raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=execution_id)
         
         self.LOGGER.debug("Execution id {}".format(executionId))
         return executionId
@@ -131,13 +158,13 @@ class Dataload():
         self.LOGGER.debug("Set Initial execution id")
             
         try:
-            executionId = util.logRunStat(self.feedId,
-                                          self.sourceId,
-                                          self.processId,
-                                          workflowid,
-                                          initialDate,
-                                          self.statusCd,
-                                          postRunCt,eligible_next_run,execution_id)
+            executionId = runstat.logRunStat(self.feedId,
+                                             self.sourceId,
+                                             self.processId,
+                                             workflowid,
+                                             initialDate,
+                                             self.statusCd,
+                                             postRunCt,eligible_next_run,execution_id)
             #return executionId
         except ex.DataloadApplicationException as dae:
             erorrCd, errorMsg = cfg.err.getErrorCd('DATALOAD_SET_EXECID_ERR')
@@ -191,9 +218,12 @@ class Dataload():
             yyyy= dt.datetime.strptime(str(execDt),'%Y%m%d').year   
             qtr = int(math.ceil(float(dt.datetime.strptime(str(execDt),'%Y%m%d').month)/3))
             
-            cmd = "hive -hiveconf year=" + str(yyyy) + " -hiveconf qtr=" + str(qtr) + " -hiveconf load_date=" + execDt + " -hiveconf  load_maintablename=" + result.hive_main_tbl_nm + " -hiveconf load_zone_nm=" + result.zone_nm + " -hiveconf load_country_cd=" + result.country_cd + " -hiveconf load_temptablename=" + result.hive_temp_tbl_nm + " -hiveconf load_columnname=" +  hiveMainTableColumnName + " -hiveconf temp_columnname=" + hiveTempTableColumnName +  "  -f " + quotedLoadMainTable
+            hiveConf = [('year', yyyy), ('qtr', qtr), ('load_date', execDt),
+                        ('load_maintablename', result.hive_main_tbl_nm), ('load_zone_nm', result.zone_nm),
+                        ('load_country_cd', result.country_cd), ('load_temptablename', result.hive_temp_tbl_nm),
+                        ('load_columnname', hiveMainTableColumnName), ('temp_columnname', hiveTempTableColumnName)]
 
-            status, output = commands.getstatusoutput(cmd)
+            status, output = hiveexecutor.runScript(quotedLoadMainTable, hiveConf)
             
         except ex.DataloadApplicationException as dae:
             errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_HIVE_QUERY_ERR')
@@ -208,6 +238,114 @@ class Dataload():
                 raise ex.DataloadSystemException(errorMsg,code=errorCd)
             else:
                 self.LOGGER.debug("Data loaded in main table : {} for filedate : {}".format(result.hive_main_tbl_nm, execDt))
+    
+    def loadMainTableDates(self,execDts,result):
+        ''' transfere data of several dates from temp table to main table, in one dynamic partition insert;
+            year and qtr partitions are derived from filedate
+        :param list execDts: dates to load
+        :param result: feed details
+        :returns : 
+        :raises DataloadSystemException: Exceptions while loading the main table
+        '''
+        self.LOGGER.info("Start Loading data in Main Hive Table : {}  for {} Dates {} to {}"
+                         .format(result.hive_main_tbl_nm, len(execDts), min(execDts), max(execDts)))
+        hqlScript="/home/cdpappdev1/codebase/dataload/source/hivemaintablemultiload.hql"
+        hiveConf = [('load_dates', ','.join(execDts)),
+                    ('load_maintablename', result.hive_main_tbl_nm), ('load_zone_nm', result.zone_nm),
+                    ('load_country_cd', result.country_cd), ('load_temptablename', result.hive_temp_tbl_nm),
+                    ('load_columnname', result.hive_main_tbl_column_nm), ('temp_columnname', result.hive_temp_tbl_column_nm)]
+        
+        status, output = hiveexecutor.runScript(hqlScript, hiveConf)
+        
+        if status > 0:
+            errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_HIVE_QUERY_ERR')
+            message = output[0:3900]
+            message = string.replace(message,"'","")
+            errorMsg = errorMsg.format(message)
+            raise ex.DataloadSystemException(errorMsg,code=errorCd)
+        else:
+            self.LOGGER.debug("Data loaded in main table : {} for {} filedates".format(result.hive_main_tbl_nm, len(execDts)))
+    
+    def loadFeedDates(self,hiveResultSet,result,processID,executionId):
+        ''' function perform following actions.. 
+                - list the blob files of every year and qtr of the dates
+                - load all dates in the main table with one insert
+                - drop the temp table partitions and record success of each date in APP_RUN_STAT
+                - if the insert fails, delete the files it left behind
+            Once the insert succeeded, no date goes back to the per date load, which would insert its rows
+            again; a date whose partition drop or status entry fails is recorded as FAILED instead
+        :param list hiveResultSet: dates to load, as returned by getTempHiveTableDistinctDate
+        :param result: feed details
+        :param int processID: process id
+        :param int executionId: execution id of the run
+        :returns : dates still to load one by one, all dates if the insert failed, and the dates 
+                   loaded whose bookkeeping failed
+        :raises DataloadSystemException: Exceptions before or during the insert
+        '''
+        execDts = [execDt[0] for execDt in hiveResultSet]
+        ''' one date per year and qtr is enough to list the blob directory of the quarter '''
+        quarterDts = dict((execDt[0:4] + str(int(math.ceil(float(execDt[4:6])/3))), execDt) for execDt in execDts).values()
+        
+        listBlobObjFilePre = []
+        for execDt in quarterDts:
+            listBlobObjFilePre.extend(self.getBlobFileCount(result,execDt,executionId))
+        
+        try:
+            self.loadMainTableDates(execDts,result)
+        except ex.DataloadSystemException as dse:
+            self.LOGGER.warning("Loading {} dates in one insert failed, loading them one by one. {}".format(len(execDts), str(dse)))
+            listBlobObjFilePost = []
+            for execDt in quarterDts:
+                listBlobObjFilePost.extend(self.getBlobFileCount(result,execDt,executionId))
+            self.DoCleanUp(result,listBlobObjFilePre,listBlobObjFilePost,executionId)
+            return hiveResultSet, []
+        
+        failedDts = []
+        droppedDts = []
+        for execDt in execDts:
+            try:
+                self.dropTempTablePartition(execDt,result)
+                droppedDts.append(execDt)
+            except Exception as e:
+                failedDts.append(execDt)
+                self._recordFailedDate(execDt,processID,result,e)
+        
+        return [], failedDts + self.recordLoadedDates(droppedDts,result,processID)
+    
+    def recordLoadedDates(self,execDts,result,processID):
+        ''' counts the main table rows of loaded dates once, and records the success of each date
+            in APP_RUN_STAT; a date whose status entry fails is recorded as FAILED
+        :param list execDts: dates loaded in the main table
+        :param result: feed details
+        :param int processID: process id
+        :returns list: dates whose success entry failed
+        '''
+        if not execDts:
+            return []
+        
+        try:
+            rowCounts = self.getLoadedRowCounts(execDts,result)
+        except Exception as e:
+            self.LOGGER.warning("Cannot count rows of Main Hive Table : {}. {}".format(result.hive_main_tbl_nm, str(e)))
+            rowCounts = {}
+        
+        failedDts = []
+        for execDt in execDts:
+            try:
+                self.setExecutionId(execDt,processID,STATUS_SUCCESS,result,rowCounts.get(execDt,0),'Y',DB_NULL)
+            except Exception as e:
+                failedDts.append(execDt)
+                self._recordFailedDate(execDt,processID,result,e)
+        
+        return failedDts
+    
+    def _recordFailedDate(self,execDt,processID,result,error):
+        ''' logs the error of a loaded date and records the date as FAILED in APP_RUN_STAT '''
+        LOGGER.error(error, dbLoad=True)
+        try:
+            self.setExecutionId(execDt,processID,STATUS_FAILED,result,0,'N',DB_NULL)
+        except ex.DataloadApplicationException as dae:
+            LOGGER.error(dae, dbLoad=True)
                            
     def getTempHiveTableDistinctDate(self,result,executionId):
         ''' function perform following actions.. 
@@ -244,7 +382,6 @@ class Dataload():
             else:
                 '''  add parttion to temp hive table '''
                 listDateOutPut = []
-                tempTableName = result.hive_temp_tbl_nm
                 
     
                 for val in listOutPut:
@@ -257,37 +394,76 @@ class Dataload():
                         errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_FLDR_FRMT')
                         errorMsg = errorMsg.format(dae.message)
                         raise ex.DataloadApplicationException(errorMsg,code=errorCd,exeId=executionId)
-              
-                    else:
-                        
-                        try:
-                            partDate = val.split('/')[-1]
-                            partLoc = result.raw_feed_data_url + "/" + partDate
-                            alterTableQuery=("ALTER TABLE {} add IF NOT EXISTS partition(filedate={}) LOCATION '{}';"
-                                         .format(tempTableName, partDate, partLoc))
-                            quotedAlterTableQuery = '"' + alterTableQuery + '"'
-                            cmd = "hive -S -e " + quotedAlterTableQuery
-                            status, output = commands.getstatusoutput(cmd)
-                            
-                        except ex.DataloadApplicationException as dae:
-                            errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_PART_ADD_ERR')
-                            errorMsg = errorMsg.format(dae.message)
-                            raise ex.DataloadApplicationException(errorMsg,code=errorCd,exeId=executionId)
-                        
-                        else: 
-                            if status > 0:
-                                errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_PART_ADD_ERR')
-                                
-                                fm = output.index("FAILED")
-                                message = output[fm:]
-                                message = string.replace(message,"'","")
-                                errorMsg = errorMsg.format(message)
-                                
-                                raise ex.DataloadSystemException(errorMsg,code=errorCd,exeId=executionId)
-                            else:
-                                self.LOGGER.debug("Partition Created for table : {} for filedate : {}".format(tempTableName, partDate))
+                
+                addedDates = self.addTempTablePartitions(result,[execDt[0] for execDt in listDateOutPut],executionId)
                                 
-                return listDateOutPut
+                return [execDt for execDt in listDateOutPut if execDt[0] in addedDates]
+    
+    def addTempTablePartitions(self,result,partDates,executionId):
+        ''' function perform following actions.. 
+                - register all date partitions of the temp table with one hive script, 
+                  PARTITION_BATCH_SIZE partitions per ALTER TABLE statement
+                - if the script fails, add the partitions one by one, so one bad partition 
+                  does not block the other dates
+        :param result: feed details
+        :param list partDates: date folders found in the feed data url
+        :param int executionId: execution id
+        :returns set: dates whose partition exists in the temp table
+        :raises DataloadSystemException: no partition could be added
+        '''
+        tempTableName = result.hive_temp_tbl_nm
+        if not partDates:
+            return set()
+        
+        alterTableQueries = []
+        for batchStart in range(0, len(partDates), PARTITION_BATCH_SIZE):
+            partitionSpecs = ["partition(filedate={}) LOCATION '{}'".format(partDate, result.raw_feed_data_url + "/" + partDate)
+                              for partDate in partDates[batchStart:batchStart + PARTITION_BATCH_SIZE]]
+            alterTableQueries.append("ALTER TABLE {} add IF NOT EXISTS {};".format(tempTableName, ' '.join(partitionSpecs)))
+        
+        status, output = self._runHiveQuery(' '.join(alterTableQueries))
+        if status == 0:
+            self.LOGGER.debug("{} partitions created for table : {}".format(len(partDates), tempTableName))
+            return set(partDates)
+        
+        self.LOGGER.warning("Adding {} partitions to table : {} in one script failed, adding them one by one"
+                            .format(len(partDates), tempTableName))
+        
+        addedDates = set()
+        partitionError = None
+        for partDate in partDates:
+            partLoc = result.raw_feed_data_url + "/" + partDate
+            alterTableQuery=("ALTER TABLE {} add IF NOT EXISTS partition(filedate={}) LOCATION '{}';"
+                         .format(tempTableName, partDate, partLoc))
+            status, output = self._runHiveQuery(alterTableQuery)
+            
+            if status > 0:
+                errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_PART_ADD_ERR')
+                errorMsg = errorMsg.format(self._getHiveFailure(output))
+                partitionError = ex.DataloadSystemException(errorMsg,code=errorCd,exeId=executionId)
+                LOGGER.error(partitionError, dbLoad=True)
+            else:
+                addedDates.add(partDate)
+                self.LOGGER.debug("Partition Created for table : {} for filedate : {}".format(tempTableName, partDate))
+        
+        if not addedDates:
+            raise partitionError
+        
+        self.failedPartitionCount += len(partDates) - len(addedDates)
+        return addedDates
+    
+    def _runHiveQuery(self,hiveQuery):
+        ''' runs hive statements in the hive session of the run, see hiveexecutor.execute
+        :param str hiveQuery: hive statements, separated by ';'
+        :returns : status and output of the hive statements
+        '''
+        return hiveexecutor.execute(hiveQuery)
+    
+    def _getHiveFailure(self,output):
+        ''' returns the hive output from the FAILED line on, without quotes '''
+        fm = output.find("FAILED")
+        message = output[fm:] if fm >= 0 else output[0:3900]
+        return string.replace(message,"'","")
                                    
     def dropTempTablePartition(self,execDt,result):
         ''' function perform following actions.. 
@@ -297,9 +473,7 @@ class Dataload():
         try:
             tempTableName = result.hive_temp_tbl_nm
             alterTableQuery="ALTER TABLE {} DROP IF EXISTS PARTITION(FileDate = {});".format(tempTableName,execDt)
-            quotedAlterTableQuery = '"' + alterTableQuery + '"'
-            cmd = "hive -S -e " + quotedAlterTableQuery
-            status, output = commands.getstatusoutput(cmd)
+            status, output = self._runHiveQuery(alterTableQuery)
             
             return status,output
         except ex.DataloadSystemException as dae:
@@ -309,10 +483,7 @@ class Dataload():
         else:
             if status > 0:
                 errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_PART_DROP_ERR')
-                fm = output.index("FAILED")
-                message = output[fm:]
-                message = string.replace(message,"'","")
-                errorMsg = errorMsg.format(message)
+                errorMsg = errorMsg.format(self._getHiveFailure(output))
                 raise ex.DataloadSystemException(errorMsg,code=errorCd)
             else:
                 self.LOGGER.debug("Partition dropped for table : {} for filedate : {}".format(tempTableName, execDt))
@@ -324,11 +495,11 @@ class Dataload():
                     - write output in a file "hivecount/000000_0" 
         '''
         hqlScript="/home/cdpappdev1/codebase/dataload/source/hivemaintablecount.hql"
-        cmd = "hive -hiveconf load_date=" + execDt + " -hiveconf load_maintablename=" + result.hive_main_tbl_nm + " -f " + hqlScript
+        hiveConf = [('load_date', execDt), ('load_maintablename', result.hive_main_tbl_nm)]
 
         self.LOGGER.info("Get Main Hive Table : {} record count for Date {}".format(result.hive_main_tbl_nm,execDt))
         try:
-            status, output = commands.getstatusoutput(cmd)
+            status, output = hiveexecutor.runScript(hqlScript, hiveConf)
             
         except ex.DataloadApplicationException as dae:
             errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_HIVE_QUERY_ERR')
@@ -337,15 +508,110 @@ class Dataload():
         else:
             if status > 0:
                 errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_HIVE_QUERY_ERR')
-                fm = output.index("FAILED")
-                message = output[fm:]
-                message = string.replace(message,"'","")
-                errorMsg = errorMsg.format(message)
+                errorMsg = errorMsg.format(self._getHiveFailure(output))
                 raise ex.DataloadSystemException(errorMsg,code=errorCd)
             else:
                 self.LOGGER.debug("Main Hive Table record count for filedate : {}".format(execDt))
                 return  status,output
     
+    def getMainHiveTableCounts(self,execDts,result,executionId=DB_NULL):
+        ''' function perform following actions.. 
+                - list the ORC files of every year and qtr of the dates in Azure Blob storage
+                - read the footer of each file with ranged reads, FOOTER_WORKER_COUNT files at a time
+                - add the row count of every file whose filedate column has one value, from the footer statistics
+                - count the dates the footers cannot tell with one hive query: dates within the filedate range
+                  of files mixing dates, and all dates of a qtr with files that have no statistics, or
+                  filedate values that are not YYYYMMDD
+        :param list execDts: dates to count
+        :param result: feed details
+        :param int executionId: execution id
+        :returns dict: main table row count of each date
+        :raises DataloadSystemException: Exceptions while listing the files or running the hive query
+        '''
+        self.LOGGER.info("Get Main Hive Table : {} record count for {} Dates".format(result.hive_main_tbl_nm,len(execDts)))
+        blobConnect = blobclient.getBlobService(result.src_storage_acc_nm, result.src_storage_acc_key)
+        destCntnr = result.raw_data_store_cntnr_nm
+        
+        ''' position of filedate in the column list, for files whose columns are named _col0, _col1, ... '''
+        columnNames = [columnName.strip().lower() for columnName in result.hive_main_tbl_column_nm.split(',')]
+        columnPosition = columnNames.index('filedate') if 'filedate' in columnNames else None
+        
+        def readFileCount(blobFile):
+            readRange = lambda start, end: blobConnect.get_blob_to_bytes(destCntnr, blobFile.name, start_range=start, end_range=end).content
+            try:
+                footer = orcstats.readFooter(readRange, blobFile.properties.content_length)
+            except (orcstats.OrcFormatError, AzureException, IOError) as e:
+                self.LOGGER.debug("No row count in the footer of {}. {}".format(blobFile.name, str(e)))
+                return None
+            return orcstats.getValueStats(footer, 'filedate', columnPosition)
+        
+        quarterDts = {}
+        for execDt in execDts:
+            quarterDts.setdefault(execDt[0:4] + str(int(math.ceil(float(execDt[4:6])/3))), []).append(execDt)
+        
+        rowCounts = dict((execDt, 0) for execDt in execDts)
+        hiveDts = set()
+        pool = ThreadPool(processes=FOOTER_WORKER_COUNT)
+        try:
+            for dates in quarterDts.values():
+                ''' files of hive staging and hidden directories, and empty blobs, are not part of the table '''
+                blobFiles = [blobFile for blobFile in self.getBlobFileCount(result,dates[0],executionId)
+                             if blobFile.properties.content_length > 0 and
+                             not re.search(r'/[._]', blobFile.name[len(result.raw_data_store_dir):])]
+                
+                for valueStats in pool.map(readFileCount, blobFiles):
+                    if valueStats is None:
+                        hiveDts.update(dates)
+                        continue
+                    
+                    minDate, maxDate, fileCount = valueStats
+                    if minDate is None:
+                        continue
+                    if not (FILEDATE_PATTERN.match(minDate) and FILEDATE_PATTERN.match(maxDate)):
+                        ''' filedate stored in another format; footer values cannot be matched to the dates '''
+                        hiveDts.update(dates)
+                    elif minDate == maxDate:
+                        if minDate in rowCounts:
+                            rowCounts[minDate] += fileCount
+                    else:
+                        hiveDts.update(execDt for execDt in dates if minDate <= execDt <= maxDate)
+        finally:
+            pool.close()
+            pool.join()
+        
+        if hiveDts:
+            self.LOGGER.info("Counting {} Dates of Main Hive Table : {} with hive, ORC footers do not tell their count"
+                             .format(len(hiveDts), result.hive_main_tbl_nm))
+            hiveQuery = ("SELECT filedate, COUNT(1) FROM {} WHERE filedate IN ({}) GROUP BY filedate;"
+                         .format(result.hive_main_tbl_nm, ','.join("'" + execDt + "'" for execDt in sorted(hiveDts))))
+            status, output = self._runHiveQuery(hiveQuery)
+            if status > 0:
+                errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_HIVE_QUERY_ERR')
+                errorMsg = errorMsg.format(self._getHiveFailure(output))
+                raise ex.DataloadSystemException(errorMsg,code=errorCd,exeId=executionId)
+            
+            ''' the hive count replaces the footer counts of the date; dates without rows are not in the output '''
+            hiveCounts = dict(re.findall(r'^(\d+)\t(\d+)\s*$', output, re.MULTILINE))
+            for execDt in hiveDts:
+                rowCounts[execDt] = int(hiveCounts.get(execDt, 0))
+        
+        return rowCounts
+    
+    def getLoadedRowCounts(self,execDts,result):
+        ''' main table row counts of loaded dates for APP_RUN_STAT, when COUNT_LOADED_ROWS is set;
+            a failed count is logged and leaves the counts at 0
+        :param list execDts: loaded dates
+        :param result: feed details
+        :returns dict: row count of each date, empty if not counted
+        '''
+        if not COUNT_LOADED_ROWS:
+            return {}
+        try:
+            return self.getMainHiveTableCounts(execDts,result)
+        except ex.DataloadSystemException as dse:
+            self.LOGGER.warning("Cannot count rows of Main Hive Table : {}. {}".format(result.hive_main_tbl_nm, str(dse)))
+            return {}
+    
     def getBlobFileCount(self,result,execDt,executionId):
         try:
             ''' extract year and qtr from the date received from feed Data folder '''
@@ -359,8 +625,7 @@ class Dataload():
             destCredPwd=result.src_storage_acc_key
             destCntnr = result.raw_data_store_cntnr_nm
         
-            blobConnect = BlockBlobService(account_name=destCredUsrNm,
-                                            account_key=destCredPwd)           
+            blobConnect = blobclient.getBlobService(destCredUsrNm, destCredPwd)           
             listBlobObjFile = blobConnect.list_blobs(container_name=destCntnr, prefix=targetDataDir)
             
         except ex.DataloadApplicationException as dae:
@@ -389,8 +654,7 @@ class Dataload():
             ''' put deltas in the list '''
             listFileToDelete = list(set(listPostFileCount) - set(listPreFileCount))       
         
-            blobConnect = BlockBlobService(account_name=destCredUsrNm,
-                                            account_key=destCredPwd)
+            blobConnect = blobclient.getBlobService(destCredUsrNm, destCredPwd)
             
             ''' Delete extra files ( post -pre) from Azure Blob Storage ''' 
             for val in listFileToDelete:
@@ -400,9 +664,7 @@ class Dataload():
             ''' Update statistics of ORC tables after deleting files '''
             LOGGER.debug("Update Statistics for ORC table : {}".format(result.hive_main_tbl_nm))
             hiveQuery = "ANALYZE TABLE " + result.hive_main_tbl_nm + " PARTITION(year,qtr) COMPUTE STATISTICS noscan;"
-            quotedHiveQuery = '"' + hiveQuery + '"'
-            hiveCommand = "hive -S -e " + quotedHiveQuery
-            commands.getstatusoutput(hiveCommand)  
+            self._runHiveQuery(hiveQuery)
             
         except ex.DataloadApplicationException as dae:
             errorCd, errorMsg = cfg.err.getErrorCd('DATALOAD_BLOB_PATH_ERR')
@@ -427,6 +689,175 @@ class Dataload():
             
 
       
+def loadFeed(dataLoad,result,prg_proc_id,initialExecutionId):
+    ''' loads the pending dates of one feed from temp hive table to main hive table, recording
+        the status of each date in APP_RUN_STAT
+    
+    :param Dataload dataLoad: data load of the run, or of the worker thread
+    :param result: feed details
+    :param int prg_proc_id: process id
+    :param int initialExecutionId: execution id of the run
+    :returns : feed status, STATUS_SUCCESS or STATUS_FAILED, and True if any date was loaded
+    :raises DataloadSystemException: Exceptions while recording the status of a date
+    '''
+    feedStatusCd = STATUS_SUCCESS
+    dateLoaded = False
+    
+    try:
+        ''' Get list of folders to load data for each feed'''
+        failedPartitionCount = dataLoad.failedPartitionCount
+        hiveResultSet=dataLoad.getTempHiveTableDistinctDate(result,initialExecutionId)
+        if dataLoad.failedPartitionCount > failedPartitionCount:
+            feedStatusCd = STATUS_FAILED
+                    
+    except (ex.DataloadApplicationException, ex.DataloadSystemException), dae:
+        dataLoad.setInitialExecId(prg_proc_id,STATUS_FAILED,initialExecutionId)
+        LOGGER.error(dae, dbLoad=True)
+        
+    else:        
+        ''' iterate for each items returned in hiveResultSet    '''
+        LOGGER.debug("find {} days of file to process:".format(len(hiveResultSet)))
+        
+        if MULTI_DATE_LOAD and len(hiveResultSet) > 1:
+            loadDts = len(hiveResultSet)
+            try:
+                hiveResultSet, failedDts = dataLoad.loadFeedDates(hiveResultSet,result,prg_proc_id,initialExecutionId)
+            except ex.DataloadSystemException as dse:
+                LOGGER.error(dse,dbLoad=True)
+            else:
+                if failedDts:
+                    feedStatusCd = STATUS_FAILED
+                dateLoaded = len(hiveResultSet) == 0 and len(failedDts) < loadDts
+        
+        loadedDts = []
+        try:
+            for execDt in hiveResultSet:             
+                try:
+
+                    '''counting files before loading data in hive '''
+                    LOGGER.info("Listing files before loading data")
+                    listBlobObjFilePre=dataLoad.getBlobFileCount(result,execDt[0],initialExecutionId)
+                    
+                    ''' Load data in main table.. '''
+                    dataLoad.loadMainTable(execDt[0],result)
+                                        
+                    ''' drop partitions from temp table ''' 
+                    dataLoad.dropTempTablePartition(execDt[0],result)
+                    loadedDts.append(execDt[0])
+                    dateLoaded = True
+                                            
+                except ex.DataloadSystemException as  dse:
+                    statusCd = STATUS_FAILED
+                    feedStatusCd = STATUS_FAILED
+                    executionId= dataLoad.setExecutionId(execDt[0],prg_proc_id,statusCd,result,0,'N',DB_NULL)
+                    dse.exeId = executionId
+                    ''' log error in db '''
+                    LOGGER.error(dse,dbLoad=True)
+                    ''' list blob objects after loading the data '''
+                    try:                       
+                        listBlobObjFilePost=dataLoad.getBlobFileCount(result,execDt[0],executionId)
+                    except ex.DataloadSystemException as  dse:
+                        LOGGER.error(dse,dbLoad=True)
+                    ''' pass pre and post count of blobs and do the clean up in case of any difference'''
+                    try: 
+                        dataLoad.DoCleanUp(result,listBlobObjFilePre,listBlobObjFilePost,executionId)
+                    except ex.DataloadSystemException as  dse:
+                        LOGGER.error(dse,dbLoad=True)
+                    
+                except ex.DataloadApplicationException as dae:
+                    statusCd = STATUS_FAILED
+                    feedStatusCd = STATUS_FAILED
+                    executionId= dataLoad.setExecutionId(execDt[0],prg_proc_id,statusCd,result,0,'N',DB_NULL)
+                    dae.exeId = executionId
+                    ''' log error in db '''
+                    LOGGER.error(dae, dbLoad=True)
+                    ''' list blob objects after loading the data '''
+                    try:                       
+                        listBlobObjFilePost=dataLoad.getBlobFileCount(result,execDt[0],executionId)
+                    except ex.DataloadSystemException as  dse:
+                        LOGGER.error(dse,dbLoad=True)
+                    ''' pass pre and post count of blobs and do the clean up in case of any difference'''
+                    try: 
+                        dataLoad.DoCleanUp(result,listBlobObjFilePre,listBlobObjFilePost,executionId)
+                    except ex.DataloadSystemException as  dse:
+                        LOGGER.error(dse,dbLoad=True)
+        finally:
+            ''' the rows of the dates loaded are counted once; their success is recorded even if a later date
+                raised, so they are not loaded again '''
+            if dataLoad.recordLoadedDates(loadedDts,result,prg_proc_id):
+                feedStatusCd = STATUS_FAILED
+    
+    return feedStatusCd, dateLoaded
+
+def loadFeedGroup(dataLoad,results,prg_proc_id,initialExecutionId):
+    ''' loads feeds of the same main hive table one after the other, on a copy of the data load of the run;
+        copies share the logger Dataload set up once, so it is not rebound while other workers log
+    
+    :param obj dataLoad: Dataload instance of the run
+    :param list results: feed details of one main hive table
+    :param int prg_proc_id: process id
+    :param int initialExecutionId: execution id of the run
+    :returns list: feed status and date loaded flag of each feed, see loadFeed
+    :raises DataloadSystemException: Exceptions while recording the status of a date
+    '''
+    dataLoad = copy.copy(dataLoad)
+    dataLoad.executionId = 0
+    dataLoad.failedPartitionCount = 0
+    return [loadFeed(dataLoad,result,prg_proc_id,initialExecutionId) for result in results]
+
+def loadFeedsInParallel(dataLoad,resultConfig,prg_proc_id,initialExecutionId,workerCount):
+    ''' loads feeds on a bounded pool of worker threads. Feeds of the same main hive table
+        run in the same worker, one after the other; hive jobs of all workers share the
+        HIVE_MAX_CONCURRENT_JOBS cap of hiveexecutor. A critical failure of one worker does
+        not interrupt the others
+    
+    :param obj dataLoad: Dataload instance of the run, copied for every worker
+    :param list resultConfig: feed details from database
+    :param int prg_proc_id: process id
+    :param int initialExecutionId: execution id of the run
+    :param int workerCount: maximum number of main hive tables loaded at the same time
+    :returns list: feed status and date loaded flag of each feed of resultConfig, see loadFeed
+    :raises Exception: first critical exception raised by a worker, once all workers are finished
+    '''
+    ''' positions in resultConfig of the feeds of each main table, in order of first appearance '''
+    feedGroups = []
+    feedGroupByTable = {}
+    for position, result in enumerate(resultConfig):
+        if result.hive_main_tbl_nm not in feedGroupByTable:
+            feedGroupByTable[result.hive_main_tbl_nm] = []
+            feedGroups.append(feedGroupByTable[result.hive_main_tbl_nm])
+        feedGroupByTable[result.hive_main_tbl_nm].append(position)
+    
+    LOGGER.info("Loading {} feeds of {} main tables with {} parallel workers".format(len(resultConfig), len(feedGroups), workerCount))
+    
+    feedStatus = [(STATUS_FAILED, False)] * len(resultConfig)
+    criticalError = None
+    
+    pool = ThreadPool(processes=min(workerCount, len(feedGroups)))
+    
+    try:
+        asyncResults = [(positions, pool.apply_async(loadFeedGroup, (dataLoad,[resultConfig[position] for position in positions],
+                                                                              prg_proc_id,initialExecutionId)))
+                        for positions in feedGroups]
+        
+        for positions, asyncResult in asyncResults:
+            try:
+                for position, status in zip(positions, asyncResult.get()):
+                    feedStatus[position] = status
+            except Exception as dae:
+                LOGGER.warning("Critical failure while loading main table : {}".format(resultConfig[positions[0]].hive_main_tbl_nm))
+                if criticalError is None:
+                    criticalError = dae
+    finally:
+        pool.close()
+        pool.join()
+    
+    if criticalError is not None:
+        raise criticalError
+    
+    return feedStatus
+
+      
 def main():
     
     ''' this method is intended to load data between temp hive table to main hive table.
@@ -475,78 +906,20 @@ def main():
     except ex.DataloadApplicationException as dae:
         LOGGER.error(dae, dbLoad=True)
         raise
-    ''' iterate for each feeds returned in resultConfig '''
-    for result in resultConfig:
-                
-        try:
-            ''' Get list of folders to load data for each feed'''
-            hiveResultSet=dataLoad.getTempHiveTableDistinctDate(result,initialExecutionId)
-                        
-        except (ex.DataloadApplicationException, ex.DataloadSystemException), dae:
-            executionId = dataLoad.setInitialExecId(prg_proc_id,STATUS_FAILED,initialExecutionId)
-            LOGGER.error(dae, dbLoad=True)
-            
-        else:        
-            ''' iterate for each items returned in hiveResultSet    '''
-            LOGGER.debug("find {} days of file to process:".format(len(hiveResultSet)))
-            
-            if len(hiveResultSet) > 0:
-                for execDt in hiveResultSet:             
-                    try:
-
-                        '''counting files before loading data in hive '''
-                        LOGGER.info("Listing files before loading data")
-                        listBlobObjFilePre=dataLoad.getBlobFileCount(result,execDt[0],initialExecutionId)
-                        
-                        ''' Load data in main table.. '''
-                        dataLoad.loadMainTable(execDt[0],result)
-                                            
-                        ''' drop partitions from temp table ''' 
-                        dataLoad.dropTempTablePartition(execDt[0],result)
-                        statusCd = STATUS_SUCCESS
-                        executionId= dataLoad.setExecutionId(execDt[0],prg_proc_id,statusCd,result,0,'Y',DB_NULL)
-                        
-                        ''' store azure account name and key '''
-                        destCredUsrNm=result.src_storage_acc_nm
-                        destCredPwd=result.src_storage_acc_key
-                                                
-                    except ex.DataloadSystemException as  dse:
-                        statusCd = STATUS_FAILED
-                        initialStatusCd = STATUS_FAILED
-                        executionId= dataLoad.setExecutionId(execDt[0],prg_proc_id,statusCd,result,0,'N',DB_NULL)
-                        dse.exeId = executionId
-                        ''' log error in db '''
-                        LOGGER.error(dse,dbLoad=True)
-                        ''' list blob objects after loading the data '''
-                        try:                       
-                            listBlobObjFilePost=dataLoad.getBlobFileCount(result,execDt[0],executionId)
-                        except ex.DataloadSystemException as  dse:
-                            LOGGER.error(dse,dbLoad=True)
-                        ''' pass pre and post count of blobs and do the clean up in case of any difference'''
-                        try: 
-                            dataLoad.DoCleanUp(result,listBlobObjFilePre,listBlobObjFilePost,executionId)
-                        except ex.DataloadSystemException as  dse:
-                            LOGGER.error(dse,dbLoad=True)
-                        
-                    except ex.DataloadApplicationException as dae:
-                        statusCd = STATUS_FAILED
-                        initialStatusCd = STATUS_FAILED
-                        executionId= dataLoad.setExecutionId(execDt[0],prg_proc_id,statusCd,result,0,'N',DB_NULL)
-                        dae.exeId = executionId
-                        ''' log error in db '''
-                        LOGGER.error(dae, dbLoad=True)
-                        ''' list blob objects after loading the data '''
-                        try:                       
-                            listBlobObjFilePost=dataLoad.getBlobFileCount(result,execDt[0],executionId)
-                        except ex.DataloadSystemException as  dse:
-                            LOGGER.error(dse,dbLoad=True)
-                        ''' pass pre and post count of blobs and do the clean up in case of any difference'''
-                        try: 
-                            dataLoad.DoCleanUp(result,listBlobObjFilePre,listBlobObjFilePost,executionId)
-                        except ex.DataloadSystemException as  dse:
-                            LOGGER.error(dse,dbLoad=True)
-                             
-                        
+    if FEED_WORKER_COUNT > 1 and len(resultConfig) > 1:
+        ''' load feeds of different main tables at the same time '''
+        feedStatus = loadFeedsInParallel(dataLoad,resultConfig,prg_proc_id,initialExecutionId,FEED_WORKER_COUNT)
+    else:
+        ''' iterate for each feeds returned in resultConfig '''
+        feedStatus = [loadFeed(dataLoad,result,prg_proc_id,initialExecutionId) for result in resultConfig]
+    
+    for result, (feedStatusCd, dateLoaded) in zip(resultConfig, feedStatus):
+        if feedStatusCd == STATUS_FAILED:
+            initialStatusCd = STATUS_FAILED
+        if dateLoaded:
+            ''' store azure account name and key '''
+            destCredUsrNm=result.src_storage_acc_nm
+            destCredPwd=result.src_storage_acc_key
          
     ''' set the final status to success or failure '''      
     if initialStatusCd == STATUS_FAILED:
@@ -554,6 +927,10 @@ def main():
     else:
         dataLoad.setInitialExecId(prg_proc_id,STATUS_SUCCESS,initialExecutionId)
     
+    ''' end the hive session and log the statement latencies '''
+    hiveexecutor.close()
+    hiveexecutor.report()
+    
     dataLoad._archiveLogs(destCredUsrNm,destCredPwd,initialExecutionId)
                            
     LOGGER.info("=========================================================================")
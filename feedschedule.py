@@ -0,0 +1,107 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: This module works out the due dates of a feed
+It has methods to performs following action:
+    - Check the source frequency of a feed
+    - Group the due dates of a date range into periods of the frequency (day, ISO week, month or year)
+
+Only the standard library is used, so the calendar can be tested on its own
+---------------------------------------------------------------------------------------
+VERSION        Date            Comments
+---------------------------------------------------------------------------------------
+PROGRAM
+---------------------------------------------------------------------------------------
+'''
+import datetime
+
+''' Module level variable '''
+''' source_frequency values of feed_config, compared case-insensitively '''
+FREQUENCY_DAILY = 'daily'
+FREQUENCY_WEEKLY = 'weekly'
+FREQUENCY_MONTHLY = 'monthly'
+FREQUENCY_YEARLY = 'yearly'
+
+
+class FeedSchedule():
+    ''' Due date calendar of a feed, built from source_frequency and day_of_run
+        A date is due when it falls in a later period (ISO week, month or year) than the
+        last execution date and is not before the day of run within its period;
+        every date is due for daily feeds
+    '''
+
+    def __init__(self, sourceFrq, dayOfRun):
+        ''' Initialize the calendar
+
+        :param str sourceFrq: Source frequency e.g. Daily, Weekly, Monthly, Yearly
+        :param int dayOfRun: Day of week, month or year from which the feed is due
+        :returns:
+        :raises:
+        '''
+        self.sourceFrq = sourceFrq.lower()
+        self.dayOfRun = dayOfRun
+
+
+    def isValid(self):
+        ''' Checks if the frequency is supported '''
+        return self.sourceFrq in (FREQUENCY_DAILY, FREQUENCY_WEEKLY, FREQUENCY_MONTHLY, FREQUENCY_YEARLY)
+
+
+    def isDaily(self):
+        ''' Checks if the feed is due every day '''
+        return self.sourceFrq == FREQUENCY_DAILY
+
+
+    def getDuePeriods(self, lastExecDt, startDate, endDate):
+        ''' Works out all due dates between start and end date in a single pass
+            If a date of a period fails, the next date of the same period becomes due;
+            dates are therefore returned grouped by period, in date order
+
+        :param date lastExecDt: Last execution date, None if the feed never ran
+        :param date startDate: Start date of the range
+        :param date endDate: End date of the range
+        :returns list duePeriods: list of lists of due dates, one list per period
+        :raises:
+        '''
+        duePeriods = []
+        execDate = startDate
+        oneDay = datetime.timedelta(days=1)
+
+        if self.isDaily():
+            while (execDate <= endDate):
+                duePeriods.append([execDate])
+                execDate = execDate + oneDay
+            return duePeriods
+
+        ''' a feed that never ran is due from the first period of the range '''
+        lastPeriod = self._period(lastExecDt)[0] if lastExecDt else None
+        currentPeriod = None
+
+        while (execDate <= endDate):
+            period, dayInPeriod = self._period(execDate)
+
+            if (lastPeriod is None or period > lastPeriod) and self.dayOfRun <= dayInPeriod:
+                if period == currentPeriod:
+                    duePeriods[-1].append(execDate)
+                else:
+                    duePeriods.append([execDate])
+                    currentPeriod = period
+
+            execDate = execDate + oneDay
+
+        return duePeriods
+
+
+    def _period(self, execDate):
+        ''' Period of a date and position of the date within the period
+
+        :param date execDate: date
+        :returns tuple: (period key, day of week, month or year)
+        :raises:
+        '''
+        if self.sourceFrq == FREQUENCY_WEEKLY:
+            isoYear, isoWeek, isoWeekday = execDate.isocalendar()
+            return (isoYear, isoWeek), isoWeekday
+
+        elif self.sourceFrq == FREQUENCY_MONTHLY:
+            return (execDate.year, execDate.month), execDate.day
+
+        return execDate.year, execDate.timetuple().tm_yday
@@ -28,17 +28,22 @@ PROGRAM
 '''
 
 ''' python libraries '''
-import os, shutil, re, datetime
+import os, shutil, re, datetime, time, copy, collections, threading, Queue
+from multiprocessing.pool import ThreadPool
 
 ''' application libraries'''
 import codebase.dataload.exceptions as ex
 import codebase.dataload.cfg as cfg
 import codebase.dataload.util as util
+import codebase.dataload.source.runstat as runstat
+import codebase.dataload.source.bandwidth as bandwidth
+import codebase.dataload.source.transfermetrics as transfermetrics
 from codebase.dataload.env import ArgParser
 from codebase.dataload.log import ABILogger 
-from codebase.dataload.source.azurCopy import AzureLoad
+from codebase.dataload.source.azurCopy import AzureLoad, BlockJournal
+from codebase.dataload.source.transfermanifest import TransferManifest, iterFiles, computeMd5
+from codebase.dataload.source.feedschedule import FeedSchedule
 from codebase.dataload.constant import DB_NULL, BLANK, STATUS_SUCCESS, STATUS_FAILED, STATUS_STARTED, \
-            DEFAULT_DATE, FREQUENCY_DAILY, FREQUENCY_WEEKLY, FREQUENCY_MONTHLY, FREQUENCY_YEARLY, \
             PGM_CLASSPATH
             
 
@@ -47,6 +52,378 @@ parser = ArgParser()
 args = parser.getArgsForGetFile()
 processMapId = ''
 workflowId = ''
+lastExecDates = None
+
+''' Parallel execution settings; feeds and dates are processed one at a time unless overridden '''
+FEED_WORKER_COUNT = int(os.environ.get('GETFILES_FEED_WORKERS', 1))
+DATE_WORKER_COUNT = int(os.environ.get('GETFILES_DATE_WORKERS', 1))
+
+''' Stream files from source to Azure, when the source module supports it; 'Y' or 'N' '''
+STREAM_TRANSFER = os.environ.get('GETFILES_STREAM_TRANSFER', 'N').upper() == 'Y'
+
+''' Last successful execution date of every feed of the source, in one round trip to the database '''
+LAST_EXEC_DATE_QUERY = ("SELECT FEED_ID, MAX(EXEC_DT) FROM SCH_APP.APP_RUN_STAT "
+                        "WHERE PRG_PROC_MAP_ID = {} AND STATUS_CD = '{}' AND FEED_ID IN ({}) "
+                        "GROUP BY FEED_ID")
+
+''' Overlap download of the next date with upload of the previous one; 'Y' or 'N'.
+    Depth is the number of downloaded dates allowed to wait for upload '''
+PIPELINE_TRANSFER = os.environ.get('GETFILES_PIPELINE', 'N').upper() == 'Y'
+PIPELINE_DEPTH = int(os.environ.get('GETFILES_PIPELINE_DEPTH', 1))
+
+''' Download objects in byte ranges on parallel source connections, when the source module supports it; 'Y' or 'N'.
+    Every worker holds one range in memory; a range is retried RANGE_RETRY_COUNT times '''
+RANGED_DOWNLOAD = os.environ.get('GETFILES_RANGED_DOWNLOAD', 'N').upper() == 'Y'
+RANGE_SIZE = int(os.environ.get('GETFILES_RANGE_SIZE_MB', 64)) * 1024 * 1024
+RANGE_WORKER_COUNT = int(os.environ.get('GETFILES_RANGE_WORKERS', 4))
+RANGE_RETRY_COUNT = int(os.environ.get('GETFILES_RANGE_RETRIES', 3))
+
+''' Keep a transfer manifest per feed and date, so a rerun only moves files missing on the VM or in Azure;
+    files changed at the source since the kept download are not fetched again. 'Y' or 'N' '''
+RESUMABLE_TRANSFER = os.environ.get('GETFILES_RESUMABLE', 'N').upper() == 'Y'
+
+''' Seconds a pooled source connection may stay idle before it is reopened instead of reused; 0 never reuses '''
+CONN_MAX_IDLE_SECONDS = int(os.environ.get('GETFILES_CONN_MAX_IDLE_SECONDS', 300))
+
+
+class FeedLogger():
+    ''' Wraps the process logger to tag every text message with the feed it belongs to.
+        Used when several feeds share the log file of one run
+    '''
+    
+    def __init__(self, logger, feedId):
+        ''' Initialize wrapper
+        
+        :param obj logger: ABILogger instance of the run
+        :param int feedId: Feed id used as logger context
+        :returns:
+        :raises:
+        '''
+        self._logger = logger
+        self._prefix = '[feedId-{}] '.format(feedId)
+        
+    def _log(self, level, msg, *args, **kwargs):
+        ''' Exceptions are passed as is, so that error code and execution id reach the error table '''
+        if isinstance(msg, basestring):
+            msg = self._prefix + msg
+        return getattr(self._logger, level)(msg, *args, **kwargs)
+    
+    def debug(self, msg, *args, **kwargs):
+        return self._log('debug', msg, *args, **kwargs)
+    
+    def info(self, msg, *args, **kwargs):
+        return self._log('info', msg, *args, **kwargs)
+    
+    def warning(self, msg, *args, **kwargs):
+        return self._log('warning', msg, *args, **kwargs)
+    
+    def error(self, msg, *args, **kwargs):
+        return self._log('error', msg, *args, **kwargs)
+    
+    def exception(self, msg, *args, **kwargs):
+        return self._log('exception', msg, *args, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(self._logger, name)
+
+
+class LastExecDateCache():
+    ''' Run scoped cache of the last successful execution date of each feed
+        Loaded with one query for all the feeds of the run and updated in memory
+        whenever a success entry is written to APP_RUN_STAT
+        Feeds missing from the bulk result are read from the database once, on first use
+    '''
+    
+    def __init__(self, processMapId):
+        ''' Initialize an empty cache
+        
+        :param int processMapId: Process map id of current run
+        :returns:
+        :raises:
+        '''
+        self.LOGGER = LOGGER
+        self.processMapId = processMapId
+        self._lastExecDates = {}
+        self._lock = threading.Lock()
+        
+        
+    def load(self, resultConfig):
+        ''' Prefetch the last execution date of all the feeds in one query
+            Feeds missing from the result, and all feeds on failure, are read feed by feed on first use
+        
+        :param list resultConfig: rows from source_config and feed_config
+        :returns:
+        :raises:
+        '''
+        self.LOGGER.debug("LastExecDateCache.load")
+        
+        feedIds = sorted(set(str(result.feed_id) for result in resultConfig))
+        
+        try:
+            query = LAST_EXEC_DATE_QUERY.format(self.processMapId, STATUS_SUCCESS, ','.join(feedIds))
+            self.LOGGER.debug("Select query is: {}".format(query))
+            resultSet = util.getResults(query)
+        except Exception as e:
+            self.LOGGER.warning("Cannot prefetch last execution dates, reading them by feed id. {}".format(str(e)))
+            return
+        
+        with self._lock:
+            for feedId, lastExecDt in resultSet:
+                if lastExecDt is not None:
+                    self._lastExecDates[str(feedId)] = self._toDate(lastExecDt)
+            
+            prefetched = len(self._lastExecDates)
+                
+        self.LOGGER.info("Prefetched last execution date of {} of {} feeds".format(prefetched, len(feedIds)))
+        
+        
+    def get(self, feedId):
+        ''' Get last execution date of a feed
+        
+        :param int feedId: Feed id
+        :returns date lastExecDt: Last execution date, None if the feed never ran
+        :raises DataloadApplicationException: Exception querying database
+        '''
+        with self._lock:
+            if str(feedId) in self._lastExecDates:
+                return self._lastExecDates[str(feedId)]
+        
+        lastExecDt = self._toDate(util.getLastExeDateForGetFilesByFeedId(feedId, self.processMapId))
+        
+        with self._lock:
+            return self._lastExecDates.setdefault(str(feedId), lastExecDt)
+        
+    
+    def update(self, feedId, execDate):
+        ''' Record a successful execution date; the latest date is kept
+        
+        :param int feedId: Feed id
+        :param date execDate: Execution date marked as success
+        :returns:
+        :raises:
+        '''
+        with self._lock:
+            lastExecDt = self._lastExecDates.get(str(feedId))
+            if str(feedId) in self._lastExecDates and (lastExecDt is None or lastExecDt < execDate):
+                self._lastExecDates[str(feedId)] = execDate
+                
+                
+    def _toDate(self, lastExecDt):
+        ''' Converts the database value to date
+        
+        :param lastExecDt: date, datetime or 'YYYY-MM-DD' string
+        :returns date: Execution date, None if not available
+        :raises:
+        '''
+        if isinstance(lastExecDt, datetime.datetime):
+            return lastExecDt.date()
+        if isinstance(lastExecDt, basestring):
+            return datetime.datetime.strptime(lastExecDt[:10], '%Y-%m-%d').date()
+        return lastExecDt or None
+
+
+class FeedNameTemplate():
+    ''' Feed names of one feed with their date place holders parsed once
+        file_nm, source_feed_dir, temp_data_dir and raw_feed_data_dir are split into
+        literal text and date formats from cfg.dateRegex(); rendering a date only runs
+        strftime once per date format and joins the parts
+        Rendered names are kept, so a date range can be rendered up front with renderRange
+    '''
+    
+    def __init__(self, fileNm, sourceFeedDir, tempDataDir, targetDataDir):
+        ''' Compile the feed name templates
+        
+        :param str fileNm: File name template
+        :param str sourceFeedDir: Source directory template
+        :param str tempDataDir: VM temp directory template
+        :param str targetDataDir: Azure directory template
+        :returns:
+        :raises:
+        '''
+        parmsList = [(re.compile(regexFormat, re.IGNORECASE), dateFormat)
+                     for regexFormat, dateFormat in cfg.dateRegex()]
+        
+        self.dateFormats = []
+        self.templates = [self._compile(template, parmsList)
+                          for template in (fileNm, sourceFeedDir, tempDataDir, targetDataDir)]
+        self._rendered = {}
+        
+        
+    def render(self, executionDate):
+        ''' Derive feed names for a date
+        
+        :param date executionDate: execution date
+        :returns tuple: file name, source directory, temp directory, target directory
+        :raises:
+        '''
+        feedNames = self._rendered.get(executionDate)
+        
+        if feedNames is None:
+            dateStrings = [executionDate.strftime(dateFormat) for dateFormat in self.dateFormats]
+            feedNames = tuple(''.join(part if isinstance(part, basestring) else dateStrings[part]
+                                      for part in template)
+                              for template in self.templates)
+            self._rendered[executionDate] = feedNames
+            
+        return feedNames
+    
+    
+    def renderRange(self, executionDates):
+        ''' Derive feed names for all the dates of a range at once
+        
+        :param list executionDates: execution dates
+        :returns dict: feed names tuple by date, see render
+        :raises:
+        '''
+        return dict((executionDate, self.render(executionDate)) for executionDate in executionDates)
+    
+    
+    def _compile(self, template, parmsList):
+        ''' Split a template into literal text and date format indexes
+            Regular expressions are applied in the order of cfg.dateRegex(), on the literal text left
+        
+        :param str template: name with date place holders
+        :param list parmsList: compiled regular expressions and date formats
+        :returns list parts: literal strings and indexes in self.dateFormats
+        :raises:
+        '''
+        parts = [template]
+        
+        for pattern, dateFormat in parmsList:
+            compiledParts = []
+            
+            for part in parts:
+                if not isinstance(part, basestring):
+                    compiledParts.append(part)
+                    continue
+                
+                position = 0
+                for match in pattern.finditer(part):
+                    if dateFormat not in self.dateFormats:
+                        self.dateFormats.append(dateFormat)
+                    compiledParts.append(part[position:match.start()])
+                    compiledParts.append(self.dateFormats.index(dateFormat))
+                    position = match.end()
+                compiledParts.append(part[position:])
+                
+            parts = [part for part in compiledParts if part != '']
+            
+        return parts
+
+
+class SourceConnectionPool():
+    ''' Run scoped pool of source connections, keyed by source environment, host and user
+        Feeds sharing a source reuse the connection opened by an earlier feed instead of
+        repeating the handshake; a connection is used by one feed or date worker at a time
+        Source modules may implement isConnectionAlive(sourceConnectObj) and
+        closeConnection(sourceConnectObj); stale connections are dropped and reopened.
+        Connections idle longer than CONN_MAX_IDLE_SECONDS, or used by a failed download, are not reused
+    '''
+    
+    def __init__(self, maxIdleSeconds=CONN_MAX_IDLE_SECONDS):
+        ''' Initialize an empty pool
+        :param int maxIdleSeconds: Seconds a connection may stay idle and still be reused
+        :returns:
+        :raises:
+        '''
+        self.maxIdleSeconds = maxIdleSeconds
+        self._idle = {}
+        self._lock = threading.Lock()
+        
+        
+    def acquire(self, getFile, recordFailure=True):
+        ''' Hands out a healthy connection for the source of the feed, opening one if none is idle
+        
+        :param obj getFile: GetFiles instance initialized for the feed
+        :param boolean recordFailure: Make the failure entry in APP_RUN_STAT, if no connection can be opened;
+                                      off for extra connections the caller can do without
+        :returns tuple: source module instance object, source connection object
+        :raises DataloadApplicationException: Exception in connecting to the source system
+        '''
+        key = self._key(getFile)
+        
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                sourceFeed, sourceConnectObj, releasedAt = idle.pop()
+            
+            if time.time() - releasedAt > self.maxIdleSeconds:
+                getFile.LOGGER.info("Connection with {} idle for {:.0f} seconds dropped, reconnecting"
+                                    .format(key[1], time.time() - releasedAt))
+            elif self._isAlive(sourceFeed, sourceConnectObj):
+                getFile.LOGGER.debug("Reusing connection with {} for feed Id-{}".format(key[1], getFile.feedId))
+                return sourceFeed, sourceConnectObj
+            
+            else:
+                getFile.LOGGER.info("Stale connection with {} dropped, reconnecting".format(key[1]))
+            self._close(sourceFeed, sourceConnectObj)
+        
+        ''' Dynamically acquire source class based on source environment name '''
+        sourceClass = getFile.getSourceModule()
+        
+        ''' Create source class object and connect to the source environment '''
+        sourceFeed = sourceClass()
+        sourceConnectObj = getFile.sourceConnection(sourceFeed, recordFailure)
+        
+        return sourceFeed, sourceConnectObj
+    
+    
+    def release(self, getFile, sourceFeed, sourceConnectObj, discard=False):
+        ''' Returns a connection to the pool, for the next feed of the same source
+        
+        :param obj getFile: GetFiles instance initialized for the feed
+        :param obj sourceFeed: Source module instance object
+        :param obj sourceConnectObj: Source connection object
+        :param boolean discard: Close the connection instead, after a failure on it
+        :returns:
+        :raises:
+        '''
+        if discard:
+            getFile.LOGGER.debug("Closing connection with {} after a failure".format(getFile.sourceHostNm))
+            self._close(sourceFeed, sourceConnectObj)
+            return
+        
+        with self._lock:
+            self._idle.setdefault(self._key(getFile), []).append((sourceFeed, sourceConnectObj, time.time()))
+            
+            
+    def closeAll(self):
+        ''' Closes all idle connections, at the end of the run '''
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            
+        for connections in idle.values():
+            for sourceFeed, sourceConnectObj, releasedAt in connections:
+                self._close(sourceFeed, sourceConnectObj)
+    
+    
+    def _key(self, getFile):
+        ''' Pool key of the feed '''
+        return (getFile.sourceEnvNm, getFile.sourceHostNm, getFile.sourceCredUsrnm)
+    
+    
+    def _isAlive(self, sourceFeed, sourceConnectObj):
+        ''' Liveness check through the source module; connections are trusted if it has none '''
+        if not hasattr(sourceFeed, 'isConnectionAlive'):
+            return True
+        try:
+            return bool(sourceFeed.isConnectionAlive(sourceConnectObj))
+        except Exception:
+            return False
+        
+        
+    def _close(self, sourceFeed, sourceConnectObj):
+        ''' Closes a connection through the source module, ignoring errors '''
+        if hasattr(sourceFeed, 'closeConnection'):
+            try:
+                sourceFeed.closeConnection(sourceConnectObj)
+            except Exception as e:
+                LOGGER.debug("Cannot close source connection. {}".format(str(e)))
+
+
+sourceConnections = SourceConnectionPool()
 
 
 class GetExecParms():
@@ -146,15 +523,15 @@ class GetExecParms():
         postRunCt = DB_NULL
         
         try:
-            self.executionId = util.logRunStat(self.sourceId,
-                                          self.feedId,
-                                          self.processMapId,
-                                          self.workflowId, 
-                                          startDate,
-                                          self.statusCd,
-                                          postRunCt,
-                                          self.eligForNextRun,
-                                          self.executionId)
+            self.executionId = runstat.logRunStat(self.sourceId,
+                                             self.feedId,
+                                             self.processMapId,
+                                             self.workflowId, 
+                                             startDate,
+                                             self.statusCd,
+                                             postRunCt,
+                                             self.eligForNextRun,
+                                             self.executionId)
         except ex.DataloadApplicationException as dae:
             erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_SET_EXECID_ERR')
             errorMsg = errorMsg.format(dae.message)
@@ -227,6 +604,21 @@ class GetExecParms():
             return resultSet
         
         
+    def loadLastExecDates(self, resultConfig):
+        ''' Creates the run scoped cache of last execution dates shared by all the feeds
+            
+        :param list resultConfig: rows from source_config and feed_config
+        :returns:
+        :raises:
+        '''
+        self.LOGGER.debug("loadLastExecDates")
+        
+        global lastExecDates
+        
+        lastExecDates = LastExecDateCache(self.processMapId)
+        lastExecDates.load(resultConfig)
+        
+        
     def finishProcessing(self, processStatus):
         ''' Makes success / failure entry into APP_RUN_STAT database
             Writes to log once processing completes
@@ -256,12 +648,21 @@ class GetFiles():
         :returns:
         :raises:
         '''
-        global LOGGER, processMapId, workflowId
+        global LOGGER, processMapId, workflowId, lastExecDates
         
         self.processMapId = processMapId
         self.workflowId = workflowId
+        self.lastExecDates = lastExecDates
         self.LOGGER = LOGGER
         
+        ''' Sub directories appended to the temp directory, when feeds or dates share the VM at the same time '''
+        self.tempDirSuffix = BLANK
+        self.dateTempDir = False
+        
+        ''' Transfer manifest of the current date; temp data is kept when a failed upload can be resumed '''
+        self.manifest = None
+        self.keepTempData = False
+        
     
     def initializeVars(self, result):
         ''' Initialize class variables
@@ -296,6 +697,9 @@ class GetFiles():
         self.destCntnr = result.raw_feed_cntnr_nm
         self.targetDataDir = result.raw_feed_data_dir        
 
+        ''' Parse file and directory names once per feed '''
+        self.feedNames = FeedNameTemplate(self.fileNm, self.sourceFeedDir, self.tempDataDir, self.targetDataDir)
+        
         ''' Set default parameters '''
         self.executionDate = datetime.date.today()
         self.eligForNextRun = DB_NULL
@@ -316,8 +720,7 @@ class GetFiles():
         self.LOGGER.debug("getStartDate")
         
         try:
-            execStartDt = util.getLastExeDateForGetFilesByFeedId(self.feedId, 
-                                                                 processMapId)
+            execStartDt = self.lastExecDates.get(self.feedId)
         except ex.DataloadApplicationException as dae:
             erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_EXEC_DATE_ERR')
             errorMsg = errorMsg.format(dae.message)
@@ -337,84 +740,63 @@ class GetFiles():
         return execStartDt
 
 
-    def checkFrequency(self, executionDate):
-        ''' Checks the frequency and day of execution for the file
-            Validates if the file is due for given execution date
-            No check is required, if frequency of execution is set to 'daily'
-        
-        :param str executionDate: file date
-        :returns boolean processFeed: Indicates whether a feed file is due or not
+    def getDuePeriods(self, startDate, endDate):
+        ''' Plans the date range: groups the due dates between start and end date into 
+            frequency periods (day, ISO week, month or year), see FeedSchedule
+            Dates of one period are tried in order until one succeeds; periods are independent,
+            so eligibility is evaluated once, against the last execution date before the range
+        
+        :param date startDate: Execution start date
+        :param date endDate: Execution end date
+        :returns list duePeriods: list of lists of due dates, one list per period
         :raises DataloadApplicationException: Exception querying database
+        :raises DataloadBusinessException: Invalid frequency
         '''
-        self.LOGGER.debug("checkFrequency")
+        self.LOGGER.debug("getDuePeriods")
         
-        self.LOGGER.debug("Validate if file is due for execution: sourceId-{}, feedId-{}, frequency-{}, date-()"
-                          .format(self.sourceId, self.feedId, self.sourceFrq, executionDate))
+        self.executionDate = startDate
+        lastExecDt = None
+        schedule = FeedSchedule(self.sourceFrq, self.sourcedayOfRun)
         
-        self.executionDate = executionDate
-        invalidFrequency = False
-        processFeed = False
+        if not schedule.isValid():
+            erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_INVALID_FEED_FRQ')
+            errorMsg = errorMsg.format(self.feedId)
+            executionId = self.setExecutionId(STATUS_FAILED)
+            raise ex.DataloadBusinessException(errorMsg, code=erorrCd, exeId=executionId)
         
-        sourceFrqlLw = self.sourceFrq.lower()
+        if not schedule.isDaily():
+            lastExecDt = self._getLastExecDate()
         
-        if sourceFrqlLw == FREQUENCY_DAILY.lower():
-            processFeed = True
-        else:
-            try:
-                lastExecDt = util.getLastExeDateForGetFilesByFeedId(self.feedId, 
-                                                                      processMapId)
-            except ex.DataloadApplicationException as dae:
-                erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_EXEC_DATE_ERR')
-                errorMsg = errorMsg.format(dae.message)
-                executionId = self.setExecutionId(STATUS_FAILED)
-                raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
-            else:
-                try:
-                    if not lastExecDt:
-                        lastExecDt = DEFAULT_DATE
-                        lastExecDt = datetime.datetime.strptime(lastExecDt,'%m/%d/%Y').date()
-                    
-                    if sourceFrqlLw == FREQUENCY_WEEKLY.lower():
-                        if (lastExecDt.isocalendar()[0] < executionDate.isocalendar()[0]
-                        and self.sourcedayOfRun <= executionDate.isoweekday()):
-                                processFeed = True
-                                
-                        elif (lastExecDt.isocalendar()[0] == executionDate.isocalendar()[0]
-                        and lastExecDt.isocalendar()[1] < executionDate.isocalendar()[1]
-                        and self.sourcedayOfRun <= executionDate.isoweekday()):
-                            processFeed = True
-                            
-                    elif sourceFrqlLw == FREQUENCY_MONTHLY.lower():
-                        if (lastExecDt.year < executionDate.year
-                        and self.sourcedayOfRun <= executionDate.day):
-                            processFeed = True
-                            
-                        elif (lastExecDt.year == executionDate.year
-                        and lastExecDt.month < executionDate.month
-                        and self.sourcedayOfRun <= executionDate.day):
-                            processFeed = True
-                            
-                    elif sourceFrqlLw == FREQUENCY_YEARLY.lower():
-                        if (lastExecDt.year < executionDate.year
-                        and self.sourcedayOfRun <= executionDate.timetuple().tm_yday):
-                            processFeed = True
-                            
-                    else:
-                        invalidFrequency = True
-                    
-                except Exception as e:
-                    erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_VALID_FREQ_ERR')
-                    errorMsg = errorMsg.format(str(e))
-                    executionId = self.setExecutionId(STATUS_FAILED)
-                    raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
-                
-                if invalidFrequency:
-                    erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_INVALID_FEED_FRQ')
-                    errorMsg = errorMsg.format(self.feedId)
-                    executionId = self.setExecutionId(STATUS_FAILED)
-                    raise ex.DataloadBusinessException(errorMsg, code=erorrCd, exeId=executionId)
-
-        return processFeed
+        try:
+            duePeriods = schedule.getDuePeriods(lastExecDt, startDate, endDate)
+        except Exception as e:
+            erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_VALID_FREQ_ERR')
+            errorMsg = errorMsg.format(str(e))
+            executionId = self.setExecutionId(STATUS_FAILED)
+            raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
+        
+        self.LOGGER.debug("{} periods due for feed Id-{} between {} and {}"
+                          .format(len(duePeriods), self.feedId, startDate, endDate))
+        
+        return duePeriods
+    
+    
+    def _getLastExecDate(self):
+        ''' Get last successful execution date of the feed
+        
+        :param:
+        :returns date lastExecDt: Last execution date, None if the feed never ran
+        :raises DataloadApplicationException: Exception querying database
+        '''
+        try:
+            lastExecDt = self.lastExecDates.get(self.feedId)
+        except ex.DataloadApplicationException as dae:
+            erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_EXEC_DATE_ERR')
+            errorMsg = errorMsg.format(dae.message)
+            executionId = self.setExecutionId(STATUS_FAILED)
+            raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
+        
+        return lastExecDt
           
     
     def setFileName(self, executionDate):
@@ -426,10 +808,20 @@ class GetFiles():
         '''
         self.LOGGER.debug("setFileName")
         
-        self.absFileNm = self._deriveFeedName(self.fileNm, executionDate)
-        self.absSourceFeedDir = self._deriveFeedName(self.sourceFeedDir, executionDate)
-        self.absTempDataDir = self._deriveFeedName(self.tempDataDir, executionDate)
-        self.absTargetDataDir = self._deriveFeedName(self.targetDataDir, executionDate)
+        (self.absFileNm, self.absSourceFeedDir,
+         self.absTempDataDir, self.absTargetDataDir) = self.feedNames.render(executionDate)
+        
+        if self.tempDirSuffix:
+            self.absTempDataDir = os.path.join(self.absTempDataDir, self.tempDirSuffix, '')
+        if self.dateTempDir:
+            self.absTempDataDir = os.path.join(self.absTempDataDir, executionDate.strftime('%Y%m%d'), '')
+        
+        self.manifest = TransferManifest(self.absTempDataDir, executionDate) if RESUMABLE_TRANSFER else None
+        self.keepTempData = False
+            
+        self.LOGGER.debug("File name-{}, source dir-{}, temp dir-{}, target dir-{} for date-{}"
+                          .format(self.absFileNm, self.absSourceFeedDir, self.absTempDataDir,
+                                  self.absTargetDataDir, executionDate))
 
 
     def getSourceModule(self):
@@ -450,10 +842,11 @@ class GetFiles():
         return sourceClass
 
 
-    def sourceConnection(self, sourceFeed):
+    def sourceConnection(self, sourceFeed, recordFailure=True):
         ''' Invokes method to establish connection with the source system
         
         :param obj sourceFeed: Source module instance object
+        :param boolean recordFailure: Make the failure entry in APP_RUN_STAT
         :returns obj sourceConnectObj: Source connection object
         :raises DataloadApplicationException: Exception in getting execution date from database
         '''
@@ -467,7 +860,7 @@ class GetFiles():
         except (ex.DataloadApplicationException, ex.DataloadSystemException) as dae:
             erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_SOURCE_CONNECT_ERR')
             errorMsg = errorMsg.format(dae.message)
-            executionId = self.setExecutionId(STATUS_FAILED)
+            executionId = self.setExecutionId(STATUS_FAILED) if recordFailure else 0
             raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
         
         self.LOGGER.debug("Connection established with {}".format(self.sourceEnvNm))
@@ -490,6 +883,17 @@ class GetFiles():
         '''
         self.LOGGER.debug("sourceDataCopy")
         
+        ''' files left on the VM by an earlier failed upload are not downloaded again '''
+        if self.manifest and self.manifest.canResume():
+            self.postRunCt = self.manifest.fileCount()
+            self.LOGGER.info("Resuming transfer of {} files from {} for Feed Id-{} Date-{}"
+                             .format(self.postRunCt, self.absTempDataDir, self.feedId, self.executionDate))
+            return
+        
+        ''' files kept for another date, or an incomplete download, are not mixed into this date '''
+        if self.manifest and os.path.exists(self.absTempDataDir):
+            self.cleanupFiles()
+        
         ''' If it doesn't exist already, create the directory on VM '''
         self._createDirectory(self.absTempDataDir)
         copyStartTime = datetime.datetime.utcnow()
@@ -501,18 +905,26 @@ class GetFiles():
             if values == self.sourceNm:
                 skipListing = True
         
+        rangedFeed = self.isRangedFeed(sourceFeed)
+        copyStartSeconds = time.time()
+        
         try:
-            fileCount = sourceFeed.transferFeedFromSourceToVM(sourceConnectObj, 
-                                                              self.sourceCntnr,
-                                                              self.absFileNm,
-                                                              self.absSourceFeedDir,
-                                                              self.absTempDataDir,
-                                                              skipListing)
+            if rangedFeed:
+                ''' large objects are pulled in byte ranges on several connections '''
+                fileCount = self.rangedDataCopy(sourceFeed, sourceConnectObj, skipListing)
+            else:
+                fileCount = sourceFeed.transferFeedFromSourceToVM(sourceConnectObj, 
+                                                                  self.sourceCntnr,
+                                                                  self.absFileNm,
+                                                                  self.absSourceFeedDir,
+                                                                  self.absTempDataDir,
+                                                                  skipListing)
         except (ex.DataloadApplicationException, ex.DataloadSystemException) as dae:
             erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_SOURCE_COPY_ERR')
             errorMsg = errorMsg.format(dae.message)
             executionId = self.setExecutionId(STATUS_FAILED)
             raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
+        copySeconds = time.time() - copyStartSeconds
         
         ''' if no matching feed is available, raise exception ''' 
         if not fileCount:
@@ -526,8 +938,295 @@ class GetFiles():
         self.postRunCt = fileCount
         timeTaken = copyEndTime - copyStartTime
         
+        ''' ranged downloads record metrics and draw bandwidth range by range '''
+        if not rangedFeed:
+            self.recordDownloadMetrics(sourceFeed, copySeconds)
+        
+        ''' the source module owns the reads and cannot be throttled while it downloads; the bytes pulled
+            are charged afterwards, which only holds its average rate and that of the transfers after it '''
+        if bandwidth.limiter.isEnabled() and not rangedFeed:
+            bandwidth.throttle(sum(fileSize for fileNm, fileSize in iterFiles(self.absTempDataDir)),
+                               self.sourceEnvNm, direction='download')
+        
         self.LOGGER.info("{} time taken to copy {} files from Source to VM for Feed Id-{} Date-{}"
                          .format(str(timeTaken),fileCount,self.feedId,self.executionDate))
+        
+        ''' record name, size and checksum of the files; without a manifest the date is not resumable '''
+        if self.manifest:
+            try:
+                self.manifest.recordDownload()
+            except (IOError, OSError) as e:
+                self.LOGGER.warning("Cannot write transfer manifest {}. {}".format(self.manifest.manifestPath, str(e)))
+                self.manifest = None
+
+
+    def isRangedFeed(self, sourceFeed):
+        ''' Checks if objects can be downloaded in byte ranges
+            Source modules whose backend supports byte ranges opt in by implementing
+            listFeedObjects(sourceConnectObj, sourceCntnr, fileNm, sourceFeedDir, skipListing), returning
+            (object name, size, base64 MD5 or None) tuples, and
+            readObjectRange(sourceConnectObj, sourceCntnr, objectNm, offset, length), returning the bytes
+        
+        :param obj sourceFeed: Source module instance object
+        :returns boolean: True, if the feed is downloaded in ranges
+        :raises:
+        '''
+        return RANGED_DOWNLOAD and hasattr(sourceFeed, 'listFeedObjects') and hasattr(sourceFeed, 'readObjectRange')
+    
+    
+    def rangedDataCopy(self, sourceFeed, sourceConnectObj, skipListing):
+        ''' Downloads the objects of the feed in byte ranges, on up to RANGE_WORKER_COUNT connections
+            The first worker uses the connection of the feed, the others borrow pooled connections.
+            Every object is checked for size, and for checksum when the source module returns one
+        
+        :param obj sourceFeed: Source module instance object
+        :param obj sourceConnectObj: Source connection object
+        :param boolean skipListing: Skip file listing on source
+        :returns int fileCount: Number of objects downloaded
+        :raises DataloadApplicationException: Range failed after retries, or object failed the check
+        :raises DataloadSystemException: Any other error while listing, preallocating or checking objects
+        '''
+        self.LOGGER.debug("rangedDataCopy")
+        
+        try:
+            return self._copyRanges(sourceFeed, sourceConnectObj, skipListing)
+        except (ex.DataloadApplicationException, ex.DataloadSystemException):
+            raise
+        except Exception as e:
+            raise ex.DataloadSystemException("Ranged download of {} failed. {} {}".format(self.absFileNm, type(e), str(e)))
+    
+    
+    def _copyRanges(self, sourceFeed, sourceConnectObj, skipListing):
+        ''' Downloads the objects of the feed in byte ranges, see rangedDataCopy
+            Objects keep their path below the source directory, so objects of the same name
+            in different sub directories do not overwrite each other
+        '''
+        feedObjects = sourceFeed.listFeedObjects(sourceConnectObj,
+                                                 self.sourceCntnr,
+                                                 self.absFileNm,
+                                                 self.absSourceFeedDir,
+                                                 skipListing)
+        
+        ''' preallocate every file, so ranges can be written at their offset in any order '''
+        rangeQueue = Queue.Queue()
+        objectStats = {}
+        for objectNm, objectSize, objectMd5 in feedObjects:
+            localFile = os.path.join(self.absTempDataDir, self._getLocalName(objectNm))
+            if not os.path.isdir(os.path.dirname(localFile)):
+                os.makedirs(os.path.dirname(localFile))
+            with open(localFile, 'wb') as localOut:
+                localOut.truncate(objectSize)
+            
+            objectStats[objectNm] = {'bytes': objectSize, 'started': None, 'finished': None, 'retries': 0}
+            for offset in range(0, objectSize, RANGE_SIZE):
+                rangeQueue.put((objectNm, localFile, offset, min(RANGE_SIZE, objectSize - offset)))
+        
+        rangeErrors = []
+        statsLock = threading.Lock()
+        
+        def fetchRange(rangeFeed, rangeConnectObj, objectNm, localFile, offset, length):
+            ''' reads one range and writes it at its offset, retrying failed reads '''
+            attempt = 0
+            while True:
+                try:
+                    bandwidth.throttle(length, self.sourceEnvNm, direction='download')
+                    rangeData = rangeFeed.readObjectRange(rangeConnectObj, self.sourceCntnr, objectNm, offset, length)
+                    if len(rangeData) != length:
+                        raise IOError("short read, {} of {} bytes".format(len(rangeData), length))
+                    
+                    with open(localFile, 'r+b') as localOut:
+                        localOut.seek(offset)
+                        localOut.write(rangeData)
+                    return attempt
+                except Exception as e:
+                    attempt += 1
+                    if attempt > RANGE_RETRY_COUNT:
+                        raise
+                    self.LOGGER.warning("Retrying range {}-{} of {}, attempt {}. {}"
+                                        .format(offset, offset + length, objectNm, attempt, str(e)))
+                    time.sleep(attempt)
+        
+        def rangeWorker(workerNo):
+            ''' downloads queued ranges until the queue is empty or a range failed '''
+            rangeFeed, rangeConnectObj = sourceFeed, sourceConnectObj
+            rangeFailed = False
+            if workerNo:
+                try:
+                    rangeFeed, rangeConnectObj = sourceConnections.acquire(self, recordFailure=False)
+                except Exception as e:
+                    ''' the other workers take over the ranges '''
+                    self.LOGGER.warning("Cannot open range connection {} with {}. {}"
+                                        .format(workerNo, self.sourceEnvNm, str(e)))
+                    return
+            try:
+                while not rangeErrors:
+                    try:
+                        objectNm, localFile, offset, length = rangeQueue.get_nowait()
+                    except Queue.Empty:
+                        return
+                    
+                    startTime = time.time()
+                    try:
+                        retries = fetchRange(rangeFeed, rangeConnectObj, objectNm, localFile, offset, length)
+                    except Exception as e:
+                        rangeFailed = True
+                        with statsLock:
+                            rangeErrors.append("Range {}-{} of {} failed after {} attempts. {}"
+                                               .format(offset, offset + length, objectNm, RANGE_RETRY_COUNT + 1, str(e)))
+                        return
+                    
+                    with statsLock:
+                        objectStat = objectStats[objectNm]
+                        objectStat['started'] = min(objectStat['started'] or startTime, startTime)
+                        objectStat['finished'] = max(objectStat['finished'] or 0, time.time())
+                        objectStat['retries'] += retries
+            finally:
+                if workerNo:
+                    sourceConnections.release(self, rangeFeed, rangeConnectObj, discard=rangeFailed)
+        
+        workerCount = max(1, min(RANGE_WORKER_COUNT, rangeQueue.qsize()))
+        rangeWorkers = [threading.Thread(target=rangeWorker, args=(workerNo,), name='range-{}'.format(workerNo))
+                        for workerNo in range(1, workerCount)]
+        for rangeThread in rangeWorkers:
+            rangeThread.start()
+        try:
+            rangeWorker(0)
+        finally:
+            for rangeThread in rangeWorkers:
+                rangeThread.join()
+        
+        if rangeErrors:
+            raise ex.DataloadApplicationException(rangeErrors[0])
+        
+        ''' check every object against the size and checksum of the source '''
+        metricsTags = self.getMetricsTags()
+        for objectNm, objectSize, objectMd5 in feedObjects:
+            localFile = os.path.join(self.absTempDataDir, self._getLocalName(objectNm))
+            if os.path.getsize(localFile) != objectSize:
+                raise ex.DataloadApplicationException("Size of {} is {}, expected {}"
+                                                      .format(localFile, os.path.getsize(localFile), objectSize))
+            if objectMd5 and computeMd5(localFile) != objectMd5:
+                raise ex.DataloadApplicationException("Checksum of {} does not match the source".format(localFile))
+            
+            objectStat = objectStats[objectNm]
+            transfermetrics.record('download', self._getLocalName(objectNm), objectSize,
+                                   (objectStat['finished'] or 0) - (objectStat['started'] or 0),
+                                   objectStat['retries'], **metricsTags)
+        
+        return len(feedObjects)
+    
+    
+    def _getLocalName(self, objectNm):
+        ''' Path of a source object in the temp directory: its path below the source directory,
+            or its full path when it is listed outside of it
+        '''
+        sourceFeedDir = self.absSourceFeedDir or ''
+        if sourceFeedDir and objectNm.startswith(sourceFeedDir):
+            objectNm = objectNm[len(sourceFeedDir):]
+        return objectNm.lstrip('/')
+    
+    
+    def recordDownloadMetrics(self, sourceFeed, copySeconds):
+        ''' Records bytes, duration and retries of every file downloaded, see transfermetrics
+            Source modules that time their own transfers return the metrics from getTransferStats;
+            otherwise one line with the total bytes and duration of the date is recorded
+        
+        :param obj sourceFeed: Source module instance object
+        :param float copySeconds: Seconds the source module took to download the date
+        :returns:
+        :raises:
+        '''
+        if not transfermetrics.isEnabled():
+            return
+        
+        metricsTags = self.getMetricsTags()
+        
+        if hasattr(sourceFeed, 'getTransferStats'):
+            for fileStats in sourceFeed.getTransferStats():
+                transfermetrics.record('download', fileStats['fileNm'], fileStats['bytes'], fileStats['seconds'],
+                                       fileStats.get('retries', 0), **metricsTags)
+            return
+        
+        fileCount, byteCount = 0, 0
+        for fileNm, fileSize in iterFiles(self.absTempDataDir):
+            fileCount += 1
+            byteCount += fileSize
+        
+        if fileCount:
+            transfermetrics.record('download', self.absFileNm, byteCount, copySeconds,
+                                   fileCount=fileCount, **metricsTags)
+    
+    
+    def getMetricsTags(self):
+        ''' Tags of the transfer metrics of the current feed and date '''
+        return {'sourceNm': self.sourceEnvNm,
+                'feedId': self.feedId,
+                'executionDate': self.executionDate.strftime('%Y-%m-%d')}
+
+
+    def isStreamingFeed(self, sourceFeed):
+        ''' Checks if files can be streamed from source to Azure without staging on the VM
+            Source modules opt in by implementing streamFeedFromSource; modules that
+            transform the data locally keep using transferFeedFromSourceToVM
+        
+        :param obj sourceFeed: Source module instance object
+        :returns boolean: True, if the feed is streamed
+        :raises:
+        '''
+        return STREAM_TRANSFER and hasattr(sourceFeed, 'streamFeedFromSource')
+    
+    
+    def streamDataCopy(self, sourceFeed, sourceConnectObj, destFeed):
+        ''' Invokes methods to stream files from source system directly to Azure
+            Calculates the time taken to copy files
+            Raises Business exception if no matching file is found
+        
+        :param obj sourceFeed: Source module instance object
+        :param obj sourceConnectObj: Source connection object
+        :param obj destFeed: Destination module instance object
+        :returns:
+        :raises DataloadApplicationException: Application exception
+        :raises DataloadBusinessException: Business exception
+        '''
+        self.LOGGER.debug("streamDataCopy")
+        
+        copyStartTime = datetime.datetime.utcnow()
+        skipListing = self.sourceNm in cfg.gfConf.skipFileListing()
+        
+        try:
+            feedStreams = sourceFeed.streamFeedFromSource(sourceConnectObj,
+                                                          self.sourceCntnr,
+                                                          self.absFileNm,
+                                                          self.absSourceFeedDir,
+                                                          skipListing)
+            
+            fileCount = destFeed.transferStreamToAzure(self.destCredUsrNm,
+                                                       self.destCredPwd,
+                                                       self.destCntnr,
+                                                       feedStreams,
+                                                       self.absTargetDataDir,
+                                                       sourceNm=self.sourceEnvNm,
+                                                       metricsTags=self.getMetricsTags())
+        except (ex.DataloadApplicationException, ex.DataloadSystemException) as dae:
+            erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_TARGET_COPY_ERR')
+            errorMsg = errorMsg.format(dae.message)
+            executionId = self.setExecutionId(STATUS_FAILED)
+            raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
+        
+        ''' if no matching feed is available, raise exception ''' 
+        if not fileCount:
+            erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_FILE_NT_RCVD')
+            errorMsg = errorMsg.format(self.absFileNm, self.executionDate)
+            executionId = self.setExecutionId(STATUS_FAILED)
+            raise ex.DataloadBusinessException(errorMsg, code=erorrCd, exeId=executionId)
+        
+        ''' Publish time taken to stream files '''
+        copyEndTime = datetime.datetime.utcnow()
+        self.postRunCt = fileCount
+        timeTaken = copyEndTime - copyStartTime
+        
+        self.LOGGER.info("{} time taken to stream {} files from Source to Azure for Feed Id-{} Date-{}"
+                         .format(str(timeTaken),fileCount,self.feedId,self.executionDate))
 
 
     def targetDataCopy(self, destFeed):
@@ -546,12 +1245,23 @@ class GetFiles():
                                                        self.destCredPwd,
                                                        self.destCntnr,
                                                        self.absTempDataDir,
-                                                       self.absTargetDataDir)
+                                                       self.absTargetDataDir,
+                                                       skipFiles=self.manifest.uploadedFiles() if self.manifest else None,
+                                                       onUploaded=self.manifest.markUploaded if self.manifest else None,
+                                                       sourceNm=self.sourceEnvNm,
+                                                       metricsTags=self.getMetricsTags())
         except (ex.DataloadApplicationException, ex.DataloadSystemException), dae:
             erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_TARGET_COPY_ERR')
             errorMsg = errorMsg.format(dae.message)
             executionId = self.setExecutionId(STATUS_FAILED)
             raise ex.DataloadApplicationException(errorMsg, code=erorrCd, exeId=executionId)
+        finally:
+            ''' uploads are saved to the manifest in batches; save the last ones '''
+            if self.manifest:
+                try:
+                    self.manifest.flush()
+                except (IOError, OSError) as e:
+                    self.LOGGER.warning("Cannot write transfer manifest {}. {}".format(self.manifest.manifestPath, str(e)))
 
         ''' Publish time taken to load files '''
         copyEndTime = datetime.datetime.utcnow()
@@ -583,7 +1293,7 @@ class GetFiles():
 
               
     def cleanupFiles(self):
-        ''' Delete entire directory tree, if it exists
+        ''' Delete entire directory tree, if it exists, with the block journals of its uploads
         
         :param:
         :returns:
@@ -591,9 +1301,14 @@ class GetFiles():
         '''
         self.LOGGER.debug("cleanupFiles")
         
+        if self.keepTempData:
+            self.LOGGER.info("Keeping directory {} for the next run to resume".format(self.absTempDataDir))
+            return
+        
         if os.path.exists(self.absTempDataDir):
             try:
                 shutil.rmtree(self.absTempDataDir)
+                BlockJournal.removeAll(self.absTempDataDir)
             except Exception as e:
                 erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_VM_DIR_SPACE_ERR')
                 errorMsg = errorMsg.format(str(e))
@@ -607,9 +1322,10 @@ class GetFiles():
         
     def setExecutionId(self, statusCd):
         ''' makes entry in the APP_RUN_STAT and returns the execution id
+            Success entries are queued and written in batches, see runstat
         
         :param str statusCd: status code
-        :returns :
+        :returns int executionId: execution id; None for success entries, see runstat
         :raises DataloadSystemException: Exceptions while deleting data from directory
         ''' 
         self.LOGGER.debug("setExecutionId")
@@ -619,15 +1335,17 @@ class GetFiles():
         nullExecId = DB_NULL
         
         try:
-            executionId = util.logRunStat(self.sourceId,
-                                          self.feedId,
-                                          self.processMapId,
-                                          self.workflowId, 
-                                          execDate,
-                                          statusCd,
-                                          self.postRunCt,
-                                          self.eligForNextRun,
-                                          nullExecId)
+            ''' success entries are queued; failure entries return the execution id for the exception '''
+            executionId = runstat.logRunStat(self.sourceId,
+                                             self.feedId,
+                                             self.processMapId,
+                                             self.workflowId, 
+                                             execDate,
+                                             statusCd,
+                                             self.postRunCt,
+                                             self.eligForNextRun,
+                                             nullExecId,
+                                             deferred=(statusCd == STATUS_SUCCESS))
             
         except ex.DataloadApplicationException as dae:
             erorrCd, errorMsg = cfg.err.getErrorCd('GETFIL_SET_EXECID_ERR')
@@ -638,34 +1356,13 @@ class GetFiles():
         self.LOGGER.info("Status-{} for Execution id-{}, Feed Id-{}, Execution Date-{}"
                          .format(statusCd, executionId, self.feedId, execDate))
         
+        ''' keep the run scoped last execution date in line with APP_RUN_STAT '''
+        if statusCd == STATUS_SUCCESS:
+            self.lastExecDates.update(self.feedId, self.executionDate)
+        
         return executionId
         
  
-    def _deriveFeedName(self, fileNm, executionDate):
-        ''' Create feed name by replacing regular expression variables with 
-        appropriate date format.
-        
-        :param str fileNm: File name
-        :param str execDtStr: Date in 'datetime' format
-        :returns str fileNm: Modified file name
-        :raises:
-        '''
-        self.LOGGER.debug("_deriveFeedName")
-        
-        parmsList = cfg.dateRegex()
-        
-        self.LOGGER.debug("Input file name-{} and date-{}".format(fileNm, executionDate))
-        self.LOGGER.debug("List of regular expressions-{}".format(parmsList))
-        
-        for regexFormat, dateFormat in parmsList:
-            execDtStr = executionDate.strftime(dateFormat)
-            fileNm = re.sub(regexFormat,execDtStr,fileNm,flags=re.IGNORECASE)
-        
-        self.LOGGER.debug("updated file name is {}".format(fileNm))
-            
-        return fileNm
-    
-    
     def _createDirectory(self, dataDir):
         ''' Create a directory, if it doesn't exists
         
@@ -699,6 +1396,508 @@ class GetFiles():
             self.LOGGER.debug("{} directory already exists".format(dataDir))
             
 
+def downloadFeedDate(getFile, sourceFeed, sourceConnectObj):
+    ''' Download stage: copies the feed files of the current date to local VM
+    
+    :param obj getFile: GetFiles instance, file names already set for the date
+    :param obj sourceFeed: Source module instance object
+    :param obj sourceConnectObj: Source connection object
+    :returns boolean: True, if the files were downloaded
+    :raises:
+    '''
+    try:
+        ''' download data to local VM '''
+        getFile.sourceDataCopy(sourceFeed, sourceConnectObj)
+    except Exception as dae:
+        getFile.LOGGER.error(dae, dbLoad=True)
+        return False
+    
+    return True
+
+
+def uploadFeedDate(getFile, destFeed):
+    ''' Upload stage: copies the downloaded files of the current date to Azure
+        and makes the success entry in APP_RUN_STAT
+        In case of failure, delete partially copied files from Azure; with a transfer manifest
+        the VM temp directory is kept, so the next run uploads again without downloading
+    
+    :param obj getFile: GetFiles instance, file names already set for the date
+    :param obj destFeed: Destination module instance object
+    :returns str dateStatus: STATUS_SUCCESS or STATUS_FAILED
+    :raises Exception: Critical exception; run must be marked as failed by the caller
+    '''
+    try: 
+        ''' upload data to target location'''
+        getFile.targetDataCopy(destFeed)
+    except Exception as dae:
+        getFile.LOGGER.error(dae, dbLoad=True)
+        ''' In case of failure, delete partially copied files from Azure '''
+        try:
+            getFile.targetDataDelete(destFeed)
+        except Exception as dae:
+            getFile.LOGGER.exception(dae, dbLoad=True)
+            raise
+        
+        ''' the downloaded files are kept; nothing of this date is left in the feed directory '''
+        if getFile.manifest:
+            try:
+                getFile.manifest.clearUploaded()
+            except (IOError, OSError) as e:
+                getFile.LOGGER.warning("Cannot write transfer manifest {}. {}".format(getFile.manifest.manifestPath, str(e)))
+            else:
+                getFile.keepTempData = True
+        return STATUS_FAILED
+    
+    ''' make success entry in APP_RUN_STAT table '''
+    getFile.setExecutionId(STATUS_SUCCESS)
+    
+    if getFile.manifest:
+        getFile.manifest.remove()
+    
+    return STATUS_SUCCESS
+
+
+def processFeedDate(getFile, sourceFeed, sourceConnectObj, destFeed, execDate):
+    ''' Copies the feed file of one day from source to Azure:
+        - download data to VM, upload to Azure and clean-up the VM
+        - or stream data from source to Azure, if the source module supports it
+        - in case of upload failure, delete partially copied files from Azure
+    
+    :param obj getFile: GetFiles instance initialized for the feed
+    :param obj sourceFeed: Source module instance object
+    :param obj sourceConnectObj: Source connection object
+    :param obj destFeed: Destination module instance object
+    :param date execDate: Execution date
+    :returns str dateStatus: STATUS_SUCCESS or STATUS_FAILED
+    :raises Exception: Critical exception; run must be marked as failed by the caller
+    '''
+    dateStatus = STATUS_FAILED
+    getFile.executionDate = execDate
+    
+    ''' substitute regular express with appropriate text in file name '''
+    getFile.setFileName(execDate)
+    
+    if getFile.isStreamingFeed(sourceFeed):
+        try:
+            ''' stream data from source to target location, skipping local VM '''
+            getFile.streamDataCopy(sourceFeed, sourceConnectObj, destFeed)
+        except Exception as dae:
+            getFile.LOGGER.error(dae, dbLoad=True)
+            ''' In case of failure, delete partially copied files from Azure '''
+            try:
+                getFile.targetDataDelete(destFeed)
+            except Exception as dae:
+                getFile.LOGGER.exception(dae, dbLoad=True)
+                raise
+        else:
+            ''' make success entry in APP_RUN_STAT table '''
+            getFile.setExecutionId(STATUS_SUCCESS)
+            dateStatus = STATUS_SUCCESS
+        
+        return dateStatus
+    
+    try:
+        if downloadFeedDate(getFile, sourceFeed, sourceConnectObj):
+            dateStatus = uploadFeedDate(getFile, destFeed)
+    finally:
+        ''' clean-up files from VM '''
+        getFile.cleanupFiles()
+        
+    return dateStatus
+
+
+def discardKeptTempData(getFile, execDates):
+    ''' Deletes the VM temp directories kept by failed uploads of dates whose period
+        a later date completed; those dates are not run again
+    
+    :param obj getFile: GetFiles instance initialized for the feed
+    :param list execDates: Dates of the period tried before the successful date
+    :returns:
+    :raises Exception: Exceptions while deleting data from directory
+    '''
+    if not RESUMABLE_TRANSFER:
+        return
+    
+    for execDate in execDates:
+        dateFile = copy.copy(getFile)
+        dateFile.setFileName(execDate)
+        if dateFile.manifest.kept:
+            dateFile.manifest.remove()
+            dateFile.cleanupFiles()
+
+
+def processFeedDatesInParallel(getFile, duePeriods, workerCount):
+    ''' Backfills the due periods of one feed on a bounded pool of worker threads
+        Every worker has its own copy of the GetFiles instance and its own pooled source connection;
+        each date is staged in its own sub directory of the temp directory
+        Dates of a period are tried in order and the period stops at the first successful date
+    
+    :param obj getFile: GetFiles instance initialized for the feed
+    :param list duePeriods: list of lists of due dates, see GetFiles.getDuePeriods
+    :param int workerCount: Maximum number of dates processed at the same time
+    :returns str processStatus: STATUS_STARTED, or STATUS_FAILED if any period failed
+    :raises Exception: First critical exception raised by a worker, once all workers are finished
+    '''
+    workerCount = min(workerCount, len(duePeriods))
+    
+    getFile.LOGGER.info("Backfilling {} periods of feed Id-{} with {} parallel workers"
+                        .format(len(duePeriods), getFile.feedId, workerCount))
+    
+    periodQueue = Queue.Queue()
+    for period in duePeriods:
+        periodQueue.put(period)
+    
+    failedPeriods = []
+    criticalErrors = []
+    stopEvent = threading.Event()
+    
+    def worker():
+        dateFile = copy.copy(getFile)
+        dateFile.dateTempDir = True
+        
+        destFeed = AzureLoad()
+        
+        try:
+            sourceFeed, sourceConnectObj = sourceConnections.acquire(dateFile)
+        except Exception as dae:
+            failedPeriods.append(None)
+            dateFile.LOGGER.error(dae, dbLoad=True)
+            return
+        
+        connected = True
+        try:
+            while not stopEvent.is_set():
+                try:
+                    period = periodQueue.get_nowait()
+                except Queue.Empty:
+                    return
+                
+                if not connected:
+                    try:
+                        sourceFeed, sourceConnectObj = sourceConnections.acquire(dateFile)
+                        connected = True
+                    except Exception as dae:
+                        ''' another worker may still process the period '''
+                        periodQueue.put(period)
+                        failedPeriods.append(None)
+                        dateFile.LOGGER.error(dae, dbLoad=True)
+                        return
+                
+                periodStatus = STATUS_FAILED
+                try:
+                    for position, execDate in enumerate(period):
+                        periodStatus = processFeedDate(dateFile, sourceFeed, sourceConnectObj, destFeed, execDate)
+                        if periodStatus == STATUS_SUCCESS:
+                            discardKeptTempData(dateFile, period[:position])
+                            break
+                except Exception as dae:
+                    criticalErrors.append(dae)
+                    stopEvent.set()
+                    sourceConnections.release(dateFile, sourceFeed, sourceConnectObj, discard=True)
+                    connected = False
+                    return
+                
+                if periodStatus == STATUS_FAILED:
+                    failedPeriods.append(period)
+                    ''' the failure may be the connection's; the next period gets a fresh one '''
+                    sourceConnections.release(dateFile, sourceFeed, sourceConnectObj, discard=True)
+                    connected = False
+        finally:
+            if connected:
+                sourceConnections.release(dateFile, sourceFeed, sourceConnectObj)
+    
+    workers = [threading.Thread(target=worker, name='feed-{}-date-{}'.format(getFile.feedId, i))
+               for i in range(workerCount)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    
+    if criticalErrors:
+        raise criticalErrors[0]
+    
+    if not periodQueue.empty():
+        getFile.LOGGER.warning("{} periods of feed Id-{} were not processed, no source connection available"
+                               .format(periodQueue.qsize(), getFile.feedId))
+    
+    if failedPeriods or not periodQueue.empty():
+        return STATUS_FAILED
+    
+    return STATUS_STARTED
+
+
+def processFeedDatesPipelined(getFile, sourceFeed, sourceConnectObj, destFeed, duePeriods):
+    ''' Overlaps the download of the next date with the upload of the previous one
+        The calling thread downloads, a second thread uploads; a bounded queue of
+        PIPELINE_DEPTH downloaded dates sits between the two stages
+        Each date is staged in its own sub directory of the temp directory
+        If a date fails, the next date of the same period is downloaded again, as in the sequential loop
+        Busy and waiting time of both stages are logged at the end, to show which side is the bottleneck
+    
+    :param obj getFile: GetFiles instance initialized for the feed
+    :param obj sourceFeed: Source module instance object
+    :param obj sourceConnectObj: Source connection object
+    :param obj destFeed: Destination module instance object
+    :param list duePeriods: list of lists of due dates, see GetFiles.getDuePeriods
+    :returns str processStatus: STATUS_STARTED, or STATUS_FAILED if any period failed
+    :raises Exception: Critical exception raised by the upload stage
+    '''
+    getFile.LOGGER.info("Pipelining download and upload of {} periods of feed Id-{}, queue depth {}"
+                        .format(len(duePeriods), getFile.feedId, PIPELINE_DEPTH))
+    
+    processStatus = STATUS_STARTED
+    uploadQueue = Queue.Queue(maxsize=PIPELINE_DEPTH)
+    retryPeriods = Queue.Queue()
+    criticalErrors = []
+    stageTime = {'downloadBusy': 0.0, 'downloadBlocked': 0.0, 'uploadBusy': 0.0, 'uploadIdle': 0.0}
+    
+    def uploader():
+        while True:
+            waitStart = time.time()
+            item = uploadQueue.get()
+            stageTime['uploadIdle'] += time.time() - waitStart
+            
+            if item is None:
+                uploadQueue.task_done()
+                return
+            
+            dateFile, triedDates, remainingDates = item
+            uploadStart = time.time()
+            try:
+                if not criticalErrors:
+                    if uploadFeedDate(dateFile, destFeed) == STATUS_FAILED:
+                        retryPeriods.put((triedDates + [dateFile.executionDate], remainingDates))
+                    else:
+                        discardKeptTempData(dateFile, triedDates)
+            except Exception as dae:
+                criticalErrors.append(dae)
+            finally:
+                ''' the thread keeps serving the queue, so the downloader never waits on it for good '''
+                try:
+                    dateFile.cleanupFiles()
+                except Exception as dae:
+                    criticalErrors.append(dae)
+                finally:
+                    stageTime['uploadBusy'] += time.time() - uploadStart
+                    uploadQueue.task_done()
+    
+    uploadThread = threading.Thread(target=uploader, name='feed-{}-upload'.format(getFile.feedId))
+    uploadThread.start()
+    
+    pipelineStart = time.time()
+    pendingPeriods = collections.deque(([], period) for period in duePeriods)
+    
+    try:
+        while not criticalErrors:
+            if not pendingPeriods:
+                ''' wait for the uploads in flight, failed periods come back for their next date '''
+                waitStart = time.time()
+                uploadQueue.join()
+                stageTime['downloadBlocked'] += time.time() - waitStart
+            
+            while not retryPeriods.empty():
+                triedDates, remainingDates = retryPeriods.get()
+                processStatus = STATUS_FAILED
+                if remainingDates:
+                    pendingPeriods.appendleft((triedDates, remainingDates))
+            
+            if not pendingPeriods:
+                break
+            
+            triedDates, period = pendingPeriods.popleft()
+            execDate, remainingDates = period[0], period[1:]
+            
+            dateFile = copy.copy(getFile)
+            dateFile.dateTempDir = True
+            dateFile.executionDate = execDate
+            
+            downloadStart = time.time()
+            dateFile.setFileName(execDate)
+            downloaded = downloadFeedDate(dateFile, sourceFeed, sourceConnectObj)
+            stageTime['downloadBusy'] += time.time() - downloadStart
+            
+            if not downloaded:
+                processStatus = STATUS_FAILED
+                dateFile.cleanupFiles()
+                if remainingDates:
+                    pendingPeriods.appendleft((triedDates + [execDate], remainingDates))
+                continue
+            
+            waitStart = time.time()
+            uploadQueue.put((dateFile, triedDates, remainingDates))
+            stageTime['downloadBlocked'] += time.time() - waitStart
+    finally:
+        uploadQueue.put(None)
+        uploadThread.join()
+    
+    elapsed = max(time.time() - pipelineStart, 0.001)
+    getFile.LOGGER.info("Pipeline utilisation for feed Id-{}: elapsed {:.1f}s, "
+                        "download busy {:.0%} ({:.1f}s), waiting on upload {:.1f}s, "
+                        "upload busy {:.0%} ({:.1f}s), waiting on download {:.1f}s"
+                        .format(getFile.feedId, elapsed,
+                                stageTime['downloadBusy'] / elapsed, stageTime['downloadBusy'],
+                                stageTime['downloadBlocked'],
+                                stageTime['uploadBusy'] / elapsed, stageTime['uploadBusy'],
+                                stageTime['uploadIdle']))
+    
+    if criticalErrors:
+        raise criticalErrors[0]
+    
+    return processStatus
+
+
+def _getDuePeriods(getFile, startDate, endDate):
+    ''' Works out the due periods of a feed and logs business exceptions, see GetFiles.getDuePeriods
+    
+    :param obj getFile: GetFiles instance initialized for the feed
+    :param date startDate: Execution start date
+    :param date endDate: Execution end date
+    :returns list duePeriods: list of lists of due dates; empty on business exception
+    :raises Exception: Critical exception; run must be marked as failed by the caller
+    '''
+    try:
+        ''' work out due dates of the whole range before any of them runs '''
+        duePeriods = getFile.getDuePeriods(startDate, endDate)
+    except ex.DataloadBusinessException as dbe:
+        duePeriods = []
+        getFile.LOGGER.error(dbe, dbLoad=True)
+    except Exception as dae:
+        getFile.LOGGER.exception(dae, dbLoad=True)
+        raise
+    
+    return duePeriods
+
+
+def processFeed(result, startDate, endDate, isolated=False):
+    ''' Runs the complete get file pipeline for one feed row:
+        - infer start date, work out due dates, get a pooled source connection
+        - copy, upload and clean-up data for each due date
+        - with DATE_WORKER_COUNT above 1, a range of several dates is backfilled in parallel
+        - with PIPELINE_TRANSFER, downloads of a range of dates overlap with uploads
+        
+    :param tuple result: one row of data from source and feed config
+    :param date startDate: Execution start date or 'None'
+    :param date endDate: Execution end date
+    :param boolean isolated: Runs the feed with its own temp directory and logger context
+    :returns str processStatus: STATUS_STARTED, or STATUS_FAILED if any day of the feed failed
+    :raises Exception: Critical exception; run must be marked as failed by the caller
+    '''
+    processStatus = STATUS_STARTED
+    
+    getFile = GetFiles()
+    
+    if isolated:
+        getFile.LOGGER = FeedLogger(LOGGER, result.feed_id)
+        getFile.tempDirSuffix = 'feed_{}'.format(result.feed_id)
+    
+    feedLogger = getFile.LOGGER
+    
+    ''' initialize variables ''' 
+    getFile.initializeVars(result)
+
+    ''' If not provided as argument, infer processing start date from database '''
+    if startDate == 'None':
+        try:
+            execDate = getFile.getStartDate()
+        except ex.DataloadBusinessException as dae:
+            execDate = BLANK
+            processStatus = STATUS_FAILED
+            feedLogger.error(dae, dbLoad=True)
+        except Exception as dae:
+            feedLogger.exception(dae, dbLoad=True)
+            raise
+    else:
+        execDate = startDate
+        
+    duePeriods = []
+    if execDate:
+        duePeriods = _getDuePeriods(getFile, execDate, endDate)
+        
+        ''' derive file names of all the due dates at once '''
+        getFile.feedNames.renderRange([dueDate for period in duePeriods for dueDate in period])
+        
+    ''' Initiate processing, if any date of the range is due '''
+    if DATE_WORKER_COUNT > 1 and len(duePeriods) > 1:
+        if processFeedDatesInParallel(getFile, duePeriods, DATE_WORKER_COUNT) == STATUS_FAILED:
+            processStatus = STATUS_FAILED
+    
+    elif duePeriods:
+        ''' Create destination class object '''
+        destFeed = AzureLoad()
+            
+        try:
+            ''' Get a connection to the source environment, shared with feeds of the same source '''
+            sourceFeed, sourceConnectObj = sourceConnections.acquire(getFile)
+        except Exception as dae:
+            processStatus = STATUS_FAILED
+            feedLogger.error(dae, dbLoad=True)
+        
+        else:
+            connectionFailed = True
+            try:
+                if PIPELINE_TRANSFER and len(duePeriods) > 1 and not getFile.isStreamingFeed(sourceFeed):
+                    ''' overlap downloads and uploads of the date range '''
+                    if processFeedDatesPipelined(getFile, sourceFeed, sourceConnectObj, destFeed,
+                                                 duePeriods) == STATUS_FAILED:
+                        processStatus = STATUS_FAILED
+                else:
+                    for period in duePeriods:
+                        ''' dates of a period are tried in order until one succeeds '''
+                        for position, dueDate in enumerate(period):
+                            if processFeedDate(getFile, sourceFeed, sourceConnectObj, destFeed, dueDate) == STATUS_SUCCESS:
+                                discardKeptTempData(getFile, period[:position])
+                                break
+                            processStatus = STATUS_FAILED
+                connectionFailed = processStatus == STATUS_FAILED
+            finally:
+                ''' a connection that failed a download is not handed to the next feed '''
+                sourceConnections.release(getFile, sourceFeed, sourceConnectObj, discard=connectionFailed)
+    
+    return processStatus
+
+
+def processFeedsInParallel(resultConfig, startDate, endDate, workerCount):
+    ''' Runs processFeed for all the feeds on a bounded pool of worker threads
+        Every feed gets its own GetFiles instance, temp directory and logger context
+        A critical failure in one feed does not interrupt the feeds already running
+    
+    :param list resultConfig: rows from source_config and feed_config
+    :param date startDate: Execution start date or 'None'
+    :param date endDate: Execution end date
+    :param int workerCount: Maximum number of feeds processed at the same time
+    :returns str processStatus: STATUS_STARTED, or STATUS_FAILED if any feed failed
+    :raises Exception: First critical exception raised by a feed, once all feeds are finished
+    '''
+    LOGGER.info("Processing {} feeds with {} parallel workers".format(len(resultConfig), workerCount))
+    
+    processStatus = STATUS_STARTED
+    criticalError = None
+    
+    pool = ThreadPool(processes=min(workerCount, len(resultConfig)))
+    
+    try:
+        asyncResults = [(result.feed_id, pool.apply_async(processFeed, (result, startDate, endDate, True)))
+                        for result in resultConfig]
+        
+        for feedId, asyncResult in asyncResults:
+            try:
+                if asyncResult.get() == STATUS_FAILED:
+                    processStatus = STATUS_FAILED
+            except Exception as dae:
+                processStatus = STATUS_FAILED
+                LOGGER.warning("Critical failure while processing feed Id-{}".format(feedId))
+                if criticalError is None:
+                    criticalError = dae
+    finally:
+        pool.close()
+        pool.join()
+    
+    if criticalError is not None:
+        raise criticalError
+    
+    return processStatus
+
+
 def main():
     ''' This method is intended to move data between two systems. It manages following activities:
         - Accept input arguments
@@ -738,96 +1937,31 @@ def main():
         
         ''' Get feed details from database '''
         resultConfig = setParms.getConfigFromDb()
+        
+        ''' Prefetch last execution date of all the feeds '''
+        setParms.loadLastExecDates(resultConfig)
     
     except Exception as dae:
         LOGGER.exception(dae, dbLoad=True)
         setParms.finishProcessing(STATUS_FAILED)
         raise
     
-    ''' Initialize class for transferring data between cloud environments ''' 
-    getFile = GetFiles()
-
-    for result in resultConfig:        
-        ''' initialize variables ''' 
-        getFile.initializeVars(result)
-
-        ''' If not provided as argument, infer processing start date from database '''
-        if startDate == 'None':
-            try:
-                execDate = getFile.getStartDate()
-            except ex.DataloadBusinessException as dae:
-                execDate = BLANK
-                processStatus = STATUS_FAILED
-                LOGGER.error(dae, dbLoad=True)
-            except Exception as dae:
-                LOGGER.exception(dae, dbLoad=True)
-                setParms.finishProcessing(STATUS_FAILED)
-                raise
+    try:
+        if FEED_WORKER_COUNT > 1 and len(resultConfig) > 1:
+            ''' transfer data for several feeds at the same time '''
+            processStatus = processFeedsInParallel(resultConfig, startDate, endDate, FEED_WORKER_COUNT)
         else:
-            execDate = startDate
-            
-        ''' Initiate processing, if valid start date is available '''
-        if execDate:
-            ''' Dynamically acquire source class based on source environment name '''
-            sourceClass = getFile.getSourceModule()
-            
-            ''' Create source class object '''
-            sourceFeed = sourceClass()
-
-            ''' Create destination class object '''
-            destFeed = AzureLoad()
-                
-            try:
-                ''' Connect to the source environment '''
-                sourceConnectObj = getFile.sourceConnection(sourceFeed)
-            except Exception as dae:
-                processStatus = STATUS_FAILED
-                LOGGER.error(dae, dbLoad=True)
-            else:
-                while (execDate <= endDate):
-                    ''' iterate over date range to process the feed for each day '''
-                    try:
-                        processFeed = getFile.checkFrequency(execDate)
-                    except ex.DataloadBusinessException as dbe:
-                        LOGGER.error(dbe, dbLoad=True)
-                    except Exception as dae:
-                        LOGGER.exception(dae, dbLoad=True)
-                        setParms.finishProcessing(STATUS_FAILED)
-                        raise
-                    
-                    if processFeed:
-                        ''' substitute regular express with appropriate text in file name '''
-                        getFile.setFileName(execDate)
-                        
-                        try:
-                            ''' download data to local VM '''
-                            getFile.sourceDataCopy(sourceFeed, sourceConnectObj)
-                        except Exception as dae:
-                            processStatus = STATUS_FAILED
-                            LOGGER.error(dae, dbLoad=True)
-                        else:
-                            ''' upload data to target location'''
-                            try: 
-                                getFile.targetDataCopy(destFeed)
-                            except Exception as dae:
-                                processStatus = STATUS_FAILED
-                                LOGGER.error(dae, dbLoad=True)
-                                ''' In case of failure, delete partially copied files from Azure '''
-                                try:
-                                    getFile.targetDataDelete(destFeed)
-                                except Exception as dae:
-                                    LOGGER.exception(dae, dbLoad=True)
-                                    setParms.finishProcessing(STATUS_FAILED)
-                                    raise
-                            else:
-                                ''' make success entry in APP_RUN_STAT table '''
-                                getFile.setExecutionId(STATUS_SUCCESS)
-                        finally:
-                            ''' clean-up files from VM '''
-                            getFile.cleanupFiles()
-                     
-                    ''' move on to next day's feed '''
-                    execDate = execDate + datetime.timedelta(days=1)
+            for result in resultConfig:
+                ''' transfer data between cloud environments, one feed at a time '''
+                if processFeed(result, startDate, endDate) == STATUS_FAILED:
+                    processStatus = STATUS_FAILED
+    except Exception:
+        setParms.finishProcessing(STATUS_FAILED)
+        raise
+    finally:
+        ''' close source connections kept for the run '''
+        sourceConnections.closeAll()
+        bandwidth.report()
                         
     setParms.finishProcessing(processStatus)
 
@@ -0,0 +1,351 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: This module runs hive statements for the data load
+It has methods to performs following action:
+    - Keep beeline sessions to HiveServer2 open for the whole run, one per concurrent caller
+    - Cap the number of hive statements running at the same time
+    - Run statements and hql scripts with hiveconf variables in the session
+    - Replace sessions whose statement runs past a timeout or whose connection is lost
+    - Fall back to one hive CLI process per call, when no JDBC url is configured
+    - Report the latency of every statement
+
+Every call returns (status, output), like commands.getstatusoutput, so callers keep
+their error handling
+---------------------------------------------------------------------------------------
+VERSION        Date            Comments
+---------------------------------------------------------------------------------------
+PROGRAM
+---------------------------------------------------------------------------------------
+'''
+import atexit
+import commands
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+import uuid
+
+from os import environ
+
+''' Module level variable '''
+''' HiveServer2 JDBC url of the persistent session; blank runs every call in its own hive CLI '''
+HIVE_JDBC_URL = environ.get('HIVE_JDBC_URL', '')
+''' Hive calls, statements or scripts, running at the same time; 0 is unlimited '''
+HIVE_MAX_CONCURRENT_JOBS = int(environ.get('HIVE_MAX_CONCURRENT_JOBS', 0))
+''' Beeline command and user of the persistent session '''
+HIVE_BEELINE_CMD = environ.get('HIVE_BEELINE_CMD', 'beeline')
+HIVE_SESSION_USER = environ.get('HIVE_SESSION_USER', '')
+''' Seconds a statement may run in a persistent session before the session is killed; 0 waits forever '''
+HIVE_STATEMENT_TIMEOUT = int(environ.get('HIVE_STATEMENT_TIMEOUT', 6 * 60 * 60))
+
+''' Beeline output of a session that lost its connection to HiveServer2 '''
+CONNECTION_ERRORS = ('No current connection', 'TTransportException', 'Could not open client transport',
+                     'Connection refused', 'Connection reset', 'Broken pipe')
+
+
+class _NoLimit():
+    ''' Job slot of an executor without a cap on concurrent statements '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        return False
+
+
+class HiveExecutor():
+    ''' This class has methods for running hive statements in persistent beeline sessions
+        beeline reads the statements from a pipe. A constant SELECT of a unique marker follows
+        every statement, so the output of the statement ends where the marker is printed
+    '''
+
+    def __init__(self, jdbcUrl=HIVE_JDBC_URL, beelineCmd=HIVE_BEELINE_CMD, user=HIVE_SESSION_USER,
+                 maxConcurrentJobs=HIVE_MAX_CONCURRENT_JOBS, statementTimeout=HIVE_STATEMENT_TIMEOUT):
+        ''' Keeps the session settings; sessions are opened on first use
+
+        :param str jdbcUrl: HiveServer2 JDBC url; blank uses the hive CLI
+        :param str beelineCmd: Beeline command
+        :param str user: Session user
+        :param int maxConcurrentJobs: Hive statements running at the same time; 0 is unlimited
+        :param int statementTimeout: Seconds a statement may run in a session; 0 waits forever
+        :returns:
+        :raises:
+        '''
+        self.LOGGER = logging.getLogger(__name__)
+        self.jdbcUrl = jdbcUrl
+        self.beelineCmd = beelineCmd
+        self.user = user
+        self.statementTimeout = statementTimeout
+
+        self._idleSessions = []
+        self._sessionLock = threading.Lock()
+        self._jobSlots = threading.BoundedSemaphore(maxConcurrentJobs) if maxConcurrentJobs > 0 else _NoLimit()
+        self._statsLock = threading.Lock()
+        self._stats = {}
+
+        atexit.register(self.close)
+
+
+    def execute(self, hiveQuery, hiveConf=None):
+        ''' Runs hive statements
+
+        :param str hiveQuery: Hive statements, separated by ';'
+        :param list hiveConf: (name, value) pairs of hiveconf variables
+        :returns : status and output, status is 0 on success
+        :raises:
+        '''
+        if not self.jdbcUrl:
+            cmd = "hive" + self._getHiveConfArgs(hiveConf) + " -S -e " + '"' + hiveQuery + '"'
+            return self._runCli(cmd, hiveQuery)
+
+        return self._runInSession(self._getSetStatements(hiveConf) + self._splitStatements(hiveQuery))
+
+
+    def runScript(self, scriptPath, hiveConf=None):
+        ''' Runs a hql script
+
+        :param str scriptPath: hql script path
+        :param list hiveConf: (name, value) pairs of hiveconf variables used by the script
+        :returns : status and output, status is 0 on success
+        :raises:
+        '''
+        if not self.jdbcUrl:
+            cmd = "hive" + self._getHiveConfArgs(hiveConf) + " -f " + scriptPath
+            return self._runCli(cmd, scriptPath, 'SCRIPT ' + os.path.basename(scriptPath))
+
+        try:
+            with open(scriptPath) as scriptIn:
+                hiveQuery = scriptIn.read()
+        except IOError as e:
+            return 1, "FAILED: cannot read hive script {}. {}".format(scriptPath, str(e))
+
+        return self._runInSession(self._getSetStatements(hiveConf) + self._splitStatements(hiveQuery))
+
+
+    def close(self):
+        ''' Ends the idle beeline sessions '''
+        with self._sessionLock:
+            idleSessions, self._idleSessions = self._idleSessions, []
+
+        for session in idleSessions:
+            self._closeSession(session)
+
+
+    def report(self):
+        ''' Logs number, total and slowest latency of the statements, per statement type '''
+        with self._statsLock:
+            stats = sorted(self._stats.items())
+
+        for statementType, (statementCount, totalSeconds, maxSeconds) in stats:
+            self.LOGGER.info("Hive {}: {} statements, {:.1f} seconds, slowest {:.1f} seconds"
+                             .format(statementType, statementCount, totalSeconds, maxSeconds))
+
+
+    def _runCli(self, cmd, statement, statementType=None):
+        ''' Runs one hive CLI process in a job slot and records its latency '''
+        with self._jobSlots:
+            startTime = time.time()
+            status, output = commands.getstatusoutput(cmd)
+            self._recordLatency(statement, time.time() - startTime, statementType)
+        return status, output
+
+
+    def _runInSession(self, statements):
+        ''' Runs statements one by one in an idle beeline session, or a new one; stops at the first failure
+            The session is held for all the statements, so set statements apply to the statements that follow
+
+        :param list statements: Hive statements without the trailing ';'
+        :returns : status and output, status is 0 on success
+        :raises:
+        '''
+        outputLines = []
+        status = 0
+
+        with self._jobSlots:
+            with self._sessionLock:
+                session = self._idleSessions.pop() if self._idleSessions else None
+
+            for statement in statements:
+                startTime = time.time()
+                session, status, statementOutput = self._runStatement(session, statement)
+                self._recordLatency(statement, time.time() - startTime)
+
+                outputLines.extend(statementOutput)
+                if status > 0:
+                    break
+
+            if session is not None:
+                with self._sessionLock:
+                    self._idleSessions.append(session)
+
+        return status, '\n'.join(outputLines)
+
+
+    def _runStatement(self, session, statement):
+        ''' Sends one statement and its end marker, and reads the output up to the marker
+            A session that lost its connection, or whose statement ran past the timeout, is killed,
+            so the next statement opens a new one instead of waiting on it
+
+        :param obj session: beeline process; None, or an ended process, opens a new session
+        :param str statement: Hive statement without the trailing ';'
+        :returns : session, None if it ended, status and output lines of the statement
+        :raises:
+        '''
+        try:
+            if session is None or session.poll() is not None:
+                session = self._openSession()
+
+            marker = 'END_OF_STATEMENT_' + uuid.uuid4().hex
+            session.stdin.write(statement + ";\nSELECT '" + marker + "';\n")
+            session.stdin.flush()
+        except (OSError, IOError) as e:
+            self._closeSession(session)
+            return None, 1, ["FAILED: hive session is not available. {}".format(str(e))]
+
+        status = 0
+        statementOutput = []
+        deadline = time.time() + self.statementTimeout if self.statementTimeout > 0 else None
+
+        while True:
+            try:
+                line = self._readLine(session, deadline)
+            except (OSError, IOError, select.error) as e:
+                self._closeSession(session, kill=True)
+                statementOutput.append("FAILED: cannot read from hive session. {}".format(str(e)))
+                return None, 1, statementOutput
+
+            if line is None:
+                self._closeSession(session, kill=True)
+                statementOutput.append("FAILED: hive statement did not finish in {} seconds, session closed"
+                                       .format(self.statementTimeout))
+                return None, 1, statementOutput
+
+            if not line:
+                ''' beeline exited, the next statement opens a new session '''
+                self._closeSession(session)
+                statementOutput.append("FAILED: hive session ended")
+                return None, 1, statementOutput
+
+            line = line.rstrip('\n')
+            if line.strip() == marker:
+                return session, status, statementOutput
+
+            statementOutput.append(line)
+            if line.startswith('Error:'):
+                status = 1
+            if any(connectionError in line for connectionError in CONNECTION_ERRORS):
+                ''' the marker never comes from a session without connection '''
+                self._closeSession(session, kill=True)
+                statementOutput.append("FAILED: hive session lost its connection")
+                return None, 1, statementOutput
+
+
+    def _readLine(self, session, deadline):
+        ''' Reads one output line of a session, waiting until the deadline at most
+            The pipe is read directly, so select never waits on output already buffered
+
+        :param obj session: beeline process
+        :param float deadline: time.time() to wait until; None waits forever
+        :returns str: line with its '\n'; '' when beeline exited; None when the deadline passed
+        :raises OSError: Error while reading the pipe
+        '''
+        while '\n' not in session.outputBuffer:
+            timeout = max(0, deadline - time.time()) if deadline is not None else None
+            readable, _, _ = select.select([session.stdout], [], [], timeout)
+            if not readable:
+                return None
+
+            chunk = os.read(session.stdout.fileno(), 64 * 1024)
+            if not chunk:
+                line, session.outputBuffer = session.outputBuffer, ''
+                return line
+            session.outputBuffer += chunk
+
+        line, session.outputBuffer = session.outputBuffer.split('\n', 1)
+        return line + '\n'
+
+
+    def _openSession(self):
+        ''' Starts beeline, connected to the JDBC url '''
+        cmd = [self.beelineCmd, '-u', self.jdbcUrl, '--silent=true', '--showHeader=false',
+               '--outputformat=tsv2', '--force=true']
+        if self.user:
+            cmd.extend(['-n', self.user])
+
+        self.LOGGER.info("Opening hive session to {}".format(self.jdbcUrl))
+        session = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, bufsize=1)
+        ''' output read from the pipe, not yet returned as a line '''
+        session.outputBuffer = ''
+        return session
+
+
+    def _closeSession(self, session, kill=False):
+        ''' Ends a beeline process; a hung or disconnected one is killed '''
+        if session is None:
+            return
+
+        try:
+            if kill and session.poll() is None:
+                session.kill()
+                session.wait()
+            elif session.poll() is None:
+                session.stdin.write("!quit\n")
+                session.stdin.close()
+                session.wait()
+        except (OSError, IOError):
+            session.kill()
+
+
+    def _recordLatency(self, statement, seconds, statementType=None):
+        ''' Logs the latency of a statement and adds it to the statistics of its type,
+            by default the first word of the statement
+        '''
+        if statementType is None:
+            statementType = statement.split(None, 1)[0].upper() if statement.strip() else 'EMPTY'
+        self.LOGGER.debug("Hive statement finished in {:.2f} seconds: {}".format(seconds, ' '.join(statement.split())[0:200]))
+
+        with self._statsLock:
+            statementCount, totalSeconds, maxSeconds = self._stats.get(statementType, (0, 0.0, 0.0))
+            self._stats[statementType] = (statementCount + 1, totalSeconds + seconds, max(maxSeconds, seconds))
+
+
+    def _getHiveConfArgs(self, hiveConf):
+        ''' Formats hiveconf variables as hive CLI arguments '''
+        return ''.join(" -hiveconf {}={}".format(name, value) for name, value in (hiveConf or []))
+
+
+    def _getSetStatements(self, hiveConf):
+        ''' Formats hiveconf variables as set statements of the session '''
+        return ["set {}={}".format(name, value) for name, value in (hiveConf or [])]
+
+
+    def _splitStatements(self, hiveQuery):
+        ''' Splits a hive script on ';', dropping comment lines, the same way the hive CLI does '''
+        hiveQuery = '\n'.join(line for line in hiveQuery.split('\n') if not line.strip().startswith('--'))
+        return [statement.strip() for statement in hiveQuery.split(';') if statement.strip()]
+
+
+''' Process wide executor shared by the data load '''
+_executor = HiveExecutor()
+
+
+def execute(hiveQuery, hiveConf=None):
+    ''' Runs hive statements with the process wide executor, see HiveExecutor.execute '''
+    return _executor.execute(hiveQuery, hiveConf)
+
+
+def runScript(scriptPath, hiveConf=None):
+    ''' Runs a hql script with the process wide executor, see HiveExecutor.runScript '''
+    return _executor.runScript(scriptPath, hiveConf)
+
+
+def close():
+    ''' Ends the sessions of the process wide executor, see HiveExecutor.close '''
+    _executor.close()
+
+
+def report():
+    ''' Logs the statement latencies of the process wide executor, see HiveExecutor.report '''
+    _executor.report()
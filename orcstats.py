@@ -0,0 +1,249 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: This module reads row counts from the footer of ORC files
+It has methods to performs following action:
+    - Read the postscript and footer at the end of an ORC file with ranged reads
+    - Decode the row count and the statistics of every column of the file
+    - Give minimum, maximum and non null rows of a column, so rows of a file with one value are counted
+
+The footer is decoded with a minimal protocol buffers reader, so no ORC library is needed.
+Footers compressed with ZLIB, or SNAPPY when python-snappy is installed, are supported
+---------------------------------------------------------------------------------------
+VERSION        Date            Comments
+---------------------------------------------------------------------------------------
+PROGRAM
+---------------------------------------------------------------------------------------
+'''
+import datetime
+import zlib
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+''' Module level variable '''
+''' Bytes read from the end of the file at first; most postscripts and footers fit '''
+TAIL_READ_SIZE = 16 * 1024
+
+ORC_MAGIC = 'ORC'
+COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_SNAPPY = 0, 1, 2
+TYPE_KIND_STRUCT = 12
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+
+class OrcFormatError(Exception):
+    ''' Raised when a file is not ORC, or its footer cannot be decoded '''
+    pass
+
+
+def readVarint(data, position):
+    ''' Decodes a protocol buffers varint
+
+    :param bytearray data: Message bytes
+    :param int position: Offset of the varint
+    :returns : value and offset after the varint
+    :raises OrcFormatError: Truncated varint
+    '''
+    value = 0
+    shift = 0
+
+    while True:
+        if position >= len(data):
+            raise OrcFormatError("Truncated varint")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def parseMessage(data):
+    ''' Decodes a protocol buffers message into its fields
+
+    :param str data: Message bytes
+    :returns dict: field number to list of values; varints as int, length delimited fields as str
+    :raises OrcFormatError: Malformed message
+    '''
+    data = bytearray(data)
+    fields = {}
+    position = 0
+
+    while position < len(data):
+        key, position = readVarint(data, position)
+        fieldNumber, wireType = key >> 3, key & 0x7
+
+        if wireType == 0:
+            value, position = readVarint(data, position)
+        elif wireType == 1:
+            value = str(data[position:position + 8])
+            position += 8
+        elif wireType == 2:
+            length, position = readVarint(data, position)
+            value = str(data[position:position + length])
+            position += length
+        elif wireType == 5:
+            value = str(data[position:position + 4])
+            position += 4
+        else:
+            raise OrcFormatError("Unsupported wire type {}".format(wireType))
+
+        if position > len(data):
+            raise OrcFormatError("Truncated message")
+        fields.setdefault(fieldNumber, []).append(value)
+
+    return fields
+
+
+def parsePackedVarints(data):
+    ''' Decodes a packed repeated varint field '''
+    data = bytearray(data)
+    values = []
+    position = 0
+
+    while position < len(data):
+        value, position = readVarint(data, position)
+        values.append(value)
+
+    return values
+
+
+def zigzagDecode(value):
+    ''' Decodes a sint32 or sint64 value '''
+    return (value >> 1) ^ -(value & 1)
+
+
+def decompress(data, compression):
+    ''' Decompresses an ORC stream: chunks with a 3 byte header of length and original flag
+
+    :param str data: Stream bytes
+    :param int compression: Compression kind of the postscript
+    :returns str: Uncompressed bytes
+    :raises OrcFormatError: Unsupported compression kind
+    '''
+    if compression == COMPRESSION_NONE:
+        return data
+    if compression == COMPRESSION_ZLIB:
+        inflate = lambda chunk: zlib.decompress(chunk, -15)
+    elif compression == COMPRESSION_SNAPPY and snappy is not None:
+        inflate = snappy.uncompress
+    else:
+        raise OrcFormatError("Unsupported compression kind {}".format(compression))
+
+    chunks = []
+    position = 0
+
+    while position < len(data):
+        header = bytearray(data[position:position + 3])
+        if len(header) < 3:
+            raise OrcFormatError("Truncated compression chunk header")
+        chunkHeader = header[0] | header[1] << 8 | header[2] << 16
+        chunkLength = chunkHeader >> 1
+        chunk = data[position + 3:position + 3 + chunkLength]
+        position += 3 + chunkLength
+
+        chunks.append(chunk if chunkHeader & 1 else inflate(chunk))
+
+    return ''.join(chunks)
+
+
+def readFooter(readRange, fileSize):
+    ''' Reads and decodes the postscript and footer of an ORC file
+
+    :param func readRange: readRange(start, end) returns bytes start to end of the file, end inclusive
+    :param int fileSize: File size
+    :returns dict: numberOfRows, columnNames, the field name to column id of the top level columns,
+                   and columnStats, the decoded ColumnStatistics message of each column id
+    :raises OrcFormatError: Not an ORC file, or a footer that cannot be decoded
+    '''
+    if fileSize < len(ORC_MAGIC) + 1:
+        raise OrcFormatError("File is too small for ORC")
+
+    tailStart = max(0, fileSize - TAIL_READ_SIZE)
+    tail = readRange(tailStart, fileSize - 1)
+
+    postscriptLength = bytearray(tail[-1:])[0]
+    postscript = parseMessage(tail[-1 - postscriptLength:-1])
+    if postscript.get(8000, [''])[0] != ORC_MAGIC:
+        raise OrcFormatError("ORC magic not found in the postscript")
+
+    footerLength = postscript.get(1, [0])[0]
+    compression = postscript.get(2, [COMPRESSION_NONE])[0]
+
+    footerEnd = len(tail) - 1 - postscriptLength
+    if footerLength > footerEnd:
+        ''' the footer starts before the first read '''
+        tail = readRange(fileSize - 1 - postscriptLength - footerLength, tailStart - 1) + tail
+        footerEnd = len(tail) - 1 - postscriptLength
+
+    try:
+        footer = parseMessage(decompress(tail[footerEnd - footerLength:footerEnd], compression))
+    except zlib.error as e:
+        raise OrcFormatError("Cannot decompress the footer. {}".format(str(e)))
+
+    types = [parseMessage(orcType) for orcType in footer.get(4, [])]
+    columnNames = {}
+    if types and types[0].get(1, [0])[0] == TYPE_KIND_STRUCT:
+        subtypes = []
+        for subtype in types[0].get(2, []):
+            ''' packed by current writers, one varint per field by old ones '''
+            subtypes.extend(parsePackedVarints(subtype) if isinstance(subtype, str) else [subtype])
+        columnNames = dict(zip([name.lower() for name in types[0].get(3, [])], subtypes))
+
+    return {'numberOfRows': footer.get(6, [0])[0],
+            'columnNames': columnNames,
+            'columnStats': [parseMessage(columnStats) for columnStats in footer.get(7, [])]}
+
+
+def getColumnRange(columnStats):
+    ''' Minimum and maximum of an integer, string or date column, as strings
+
+    :param dict columnStats: Decoded ColumnStatistics message
+    :returns : minimum and maximum, None if the statistics have no range
+    :raises:
+    '''
+    if 2 in columnStats:
+        intStats = parseMessage(columnStats[2][0])
+        if 1 in intStats and 2 in intStats:
+            return str(zigzagDecode(intStats[1][0])), str(zigzagDecode(intStats[2][0]))
+    if 4 in columnStats:
+        stringStats = parseMessage(columnStats[4][0])
+        if 1 in stringStats and 2 in stringStats:
+            return stringStats[1][0], stringStats[2][0]
+    if 7 in columnStats:
+        dateStats = parseMessage(columnStats[7][0])
+        if 1 in dateStats and 2 in dateStats:
+            return tuple((EPOCH_DATE + datetime.timedelta(days=zigzagDecode(dateStats[field][0]))).strftime('%Y%m%d')
+                         for field in (1, 2))
+    return None
+
+
+def getValueStats(footer, columnNm, columnPosition=None):
+    ''' Minimum, maximum and non null rows of a column of a file, from the footer statistics
+        When minimum and maximum are equal, all the non null rows have that value
+
+    :param dict footer: Footer returned by readFooter
+    :param str columnNm: Column name
+    :param int columnPosition: Position of the column, for files whose columns are named _col0, _col1, ...
+    :returns : (minimum, maximum, non null rows); (None, None, 0) if the column is null in all rows;
+               None if the footer has no statistics of the column
+    :raises:
+    '''
+    columnId = footer['columnNames'].get(columnNm.lower())
+    if columnId is None and columnPosition is not None:
+        columnId = footer['columnNames'].get('_col{}'.format(columnPosition))
+    if columnId is None or columnId >= len(footer['columnStats']):
+        return None
+
+    columnStats = footer['columnStats'][columnId]
+    if 1 not in columnStats:
+        return None
+    valueCount = columnStats[1][0]
+    if valueCount == 0:
+        return None, None, 0
+
+    columnRange = getColumnRange(columnStats)
+    if columnRange is None:
+        return None
+
+    return columnRange[0], columnRange[1], valueCount
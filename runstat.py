@@ -0,0 +1,157 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: This module buffers entries to the APP_RUN_STAT table
+It has methods to performs following action:
+    - Queue status rows whose execution id is not needed by the caller
+    - Flush queued rows from a background thread, on size or time threshold and at process exit
+    - Write rows synchronously, when the caller needs the execution id
+
+Rows are written one by one through util.logRunStat, the only write helper of APP_RUN_STAT;
+batching takes the writes of deferred rows off the transfer threads, not the round trips
+
+---------------------------------------------------------------------------------------
+VERSION        Date            Comments
+---------------------------------------------------------------------------------------
+PROGRAM
+---------------------------------------------------------------------------------------
+'''
+import atexit
+import logging
+import threading
+
+from os import environ
+
+import codebase.dataload.util as util
+
+''' Module level variable '''
+''' Rows queued before a flush is triggered; 1 writes every row straight away '''
+RUN_STAT_BATCH_SIZE = int(environ.get('RUN_STAT_BATCH_SIZE', 1))
+''' Maximum number of seconds a queued row waits before it is flushed '''
+RUN_STAT_FLUSH_SECONDS = float(environ.get('RUN_STAT_FLUSH_SECONDS', 5))
+
+
+class RunStatWriter():
+    ''' This class has methods for writing status rows to APP_RUN_STAT
+        Deferred rows are written by a background thread, a batch at a time; every synchronous write
+        flushes the queue first, so rows reach the table in the order they were logged
+        Deferred rows never return their execution id, whatever the batch size, so no caller
+        comes to depend on it; callers only need the id of failure and run level rows
+    '''
+
+    def __init__(self, batchSize=RUN_STAT_BATCH_SIZE, flushSeconds=RUN_STAT_FLUSH_SECONDS):
+        ''' Initiates the logger and an empty queue
+
+        :param int batchSize: Rows queued before a flush is triggered
+        :param float flushSeconds: Maximum seconds a queued row waits
+        :returns:
+        :raises:
+        '''
+        self.LOGGER = logging.getLogger(__name__)
+        self.batchSize = batchSize
+        self.flushSeconds = flushSeconds
+
+        self._pending = []
+        self._pendingLock = threading.Lock()
+        self._writeLock = threading.RLock()
+        self._flushEvent = threading.Event()
+        self._flushThread = None
+
+        atexit.register(self.flush)
+
+
+    def logRunStat(self, sourceId, feedId, processMapId, workflowId, execDate, statusCd,
+                   postRunCt, eligForNextRun, executionId, deferred=False):
+        ''' Makes an entry in APP_RUN_STAT, see util.logRunStat
+
+        :param int sourceId: Source id
+        :param int feedId: Feed id
+        :param int processMapId: Process map id
+        :param int workflowId: Workflow id of parent job
+        :param str execDate: Execution date
+        :param str statusCd: Status code
+        :param int postRunCt: Number of files or rows processed
+        :param str eligForNextRun: Eligible for next run flag
+        :param int executionId: Execution id to update, DB_NULL for a new entry
+        :param boolean deferred: Queue the row; the caller does not need the execution id
+        :returns int executionId: Execution id; None for deferred rows
+        :raises DataloadApplicationException: Exception while making entry in the table
+        '''
+        row = (sourceId, feedId, processMapId, workflowId, execDate, statusCd,
+               postRunCt, eligForNextRun, executionId)
+
+        if deferred and self.batchSize > 1:
+            with self._pendingLock:
+                self._pending.append(row)
+                batchFull = len(self._pending) >= self.batchSize
+
+            self._startFlushThread()
+            if batchFull:
+                self._flushEvent.set()
+            return None
+
+        with self._writeLock:
+            self.flush()
+            executionId = util.logRunStat(*row)
+
+        return None if deferred else executionId
+
+
+    def flush(self):
+        ''' Writes all queued rows, in the order they were queued
+            Rows that cannot be written stay in the queue for the next flush
+
+        :param:
+        :returns:
+        :raises DataloadApplicationException: Exception while making entry in the table
+        '''
+        with self._writeLock:
+            with self._pendingLock:
+                batch, self._pending = self._pending, []
+
+            written = 0
+            try:
+                for row in batch:
+                    util.logRunStat(*row)
+                    written += 1
+            except Exception:
+                with self._pendingLock:
+                    self._pending[0:0] = batch[written:]
+                raise
+
+            if batch:
+                self.LOGGER.debug("Flushed {} rows to APP_RUN_STAT".format(len(batch)))
+
+
+    def _startFlushThread(self):
+        ''' Starts the background flush thread on first queued row '''
+        with self._pendingLock:
+            if self._flushThread is None:
+                self._flushThread = threading.Thread(target=self._flushLoop, name='run-stat-writer')
+                self._flushThread.daemon = True
+                self._flushThread.start()
+
+
+    def _flushLoop(self):
+        ''' Flushes the queue every flushSeconds, or as soon as a batch is full '''
+        while True:
+            self._flushEvent.wait(self.flushSeconds)
+            self._flushEvent.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.LOGGER.warning("Cannot flush rows to APP_RUN_STAT, retrying later. {}".format(str(e)))
+
+
+''' Process wide writer shared by getfiles and dataload '''
+_writer = RunStatWriter()
+
+
+def logRunStat(sourceId, feedId, processMapId, workflowId, execDate, statusCd,
+               postRunCt, eligForNextRun, executionId, deferred=False):
+    ''' Makes an entry in APP_RUN_STAT through the process wide writer, see RunStatWriter.logRunStat '''
+    return _writer.logRunStat(sourceId, feedId, processMapId, workflowId, execDate, statusCd,
+                              postRunCt, eligForNextRun, executionId, deferred=deferred)
+
+
+def flush():
+    ''' Writes all queued rows of the process wide writer, see RunStatWriter.flush '''
+    _writer.flush()
@@ -0,0 +1,5 @@
+''' Modules of the repository are deployed under codebase/dataload; tests import them by file name '''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
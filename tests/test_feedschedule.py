@@ -0,0 +1,88 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: Tests of the due date calendar of feedschedule, FeedSchedule
+Due periods and due checks of every frequency across the Dec to Jan (Q4 to Q1) boundary
+---------------------------------------------------------------------------------------
+'''
+import datetime
+
+import pytest
+
+from feedschedule import FeedSchedule
+
+
+def d(dateStr):
+    ''' date from a YYYY-MM-DD string '''
+    return datetime.datetime.strptime(dateStr, '%Y-%m-%d').date()
+
+
+def dateRange(startDate, endDate):
+    ''' all dates from start to end date, both included '''
+    dates = []
+    execDate = d(startDate)
+    while execDate <= d(endDate):
+        dates.append(execDate)
+        execDate = execDate + datetime.timedelta(days=1)
+    return dates
+
+
+@pytest.mark.parametrize('sourceFrq, isValid', [
+    ('Daily', True),
+    ('WEEKLY', True),
+    ('monthly', True),
+    ('Yearly', True),
+    ('Quarterly', False),
+    ('Hourly', False),
+])
+def test_isValid(sourceFrq, isValid):
+    assert FeedSchedule(sourceFrq, 1).isValid() == isValid
+
+
+@pytest.mark.parametrize('sourceFrq, dayOfRun, lastExecDt, startDate, endDate, duePeriods', [
+    # daily: every date is its own period, the last execution date does not matter
+    ('Daily', 0, None, '2023-12-30', '2024-01-02',
+     [[d('2023-12-30')], [d('2023-12-31')], [d('2024-01-01')], [d('2024-01-02')]]),
+    ('Daily', 0, '2024-01-02', '2023-12-31', '2024-01-01', [[d('2023-12-31')], [d('2024-01-01')]]),
+    # weekly from Wednesday: ISO week 52 of 2023, week 1 of 2024 starts on Monday 2024-01-01
+    ('Weekly', 3, '2023-12-20', '2023-12-25', '2024-01-10',
+     [dateRange('2023-12-27', '2023-12-31'), dateRange('2024-01-03', '2024-01-07'), [d('2024-01-10')]]),
+    # weekly: ISO week 1 of 2025 starts on Monday 2024-12-30
+    ('Weekly', 1, '2024-12-23', '2024-12-28', '2025-01-06',
+     [dateRange('2024-12-30', '2025-01-05'), [d('2025-01-06')]]),
+    # weekly: the week of the last execution is not due again
+    ('Weekly', 1, '2024-12-31', '2024-12-30', '2025-01-05', []),
+    # monthly from the 15th: December (Q4) and January (Q1)
+    ('Monthly', 15, '2023-11-20', '2023-12-10', '2024-01-20',
+     [dateRange('2023-12-15', '2023-12-31'), dateRange('2024-01-15', '2024-01-20')]),
+    ('Monthly', 1, '2023-12-05', '2023-12-28', '2024-01-02', [[d('2024-01-01'), d('2024-01-02')]]),
+    # monthly: a feed that never ran is due from the first month of the range
+    ('Monthly', 31, None, '2023-11-29', '2024-01-01', [[d('2023-12-31')]]),
+    # yearly: a new year is due from its day of run
+    ('Yearly', 1, '2023-06-01', '2023-12-30', '2024-01-02', [[d('2024-01-01'), d('2024-01-02')]]),
+    ('Yearly', 1, '2024-01-01', '2023-12-30', '2024-01-02', []),
+    # yearly from day 366: only due in leap years
+    ('Yearly', 366, '2023-01-01', '2024-12-29', '2025-01-01', [[d('2024-12-31')]]),
+])
+def test_getDuePeriods(sourceFrq, dayOfRun, lastExecDt, startDate, endDate, duePeriods):
+    schedule = FeedSchedule(sourceFrq, dayOfRun)
+    lastExecDt = d(lastExecDt) if lastExecDt else None
+
+    assert schedule.getDuePeriods(lastExecDt, d(startDate), d(endDate)) == duePeriods
+
+
+@pytest.mark.parametrize('sourceFrq, dayOfRun, lastExecDt, execDate, isDue', [
+    ('Daily', 0, '2023-12-31', '2023-12-31', True),
+    ('Weekly', 1, '2023-12-31', '2024-01-01', True),
+    ('Weekly', 2, '2023-12-31', '2024-01-01', False),
+    ('Weekly', 1, '2024-12-30', '2025-01-05', False),
+    ('Monthly', 1, '2023-12-31', '2024-01-01', True),
+    ('Monthly', 1, '2023-12-01', '2023-12-31', False),
+    ('Monthly', 31, '2023-12-31', '2024-01-31', True),
+    ('Monthly', 31, '2024-01-31', '2024-02-29', False),
+    ('Yearly', 1, '2023-12-31', '2024-01-01', True),
+    ('Yearly', 2, '2023-12-31', '2024-01-01', False),
+    ('Yearly', 1, '2024-01-01', '2024-12-31', False),
+])
+def test_isDue(sourceFrq, dayOfRun, lastExecDt, execDate, isDue):
+    schedule = FeedSchedule(sourceFrq, dayOfRun)
+
+    assert bool(schedule.getDuePeriods(d(lastExecDt), d(execDate), d(execDate))) == isDue
@@ -0,0 +1,246 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: This module keeps a transfer manifest for one feed and date
+It has methods to performs following action:
+    - Record name, size and checksum of the files downloaded to local VM
+    - Record the files uploaded to Azure Blob storage
+    - Tell a rerun which files are already downloaded or uploaded
+
+The manifest is a JSON file kept next to the VM temp directory, so that it survives
+the clean-up of the directory
+---------------------------------------------------------------------------------------
+VERSION        Date            Comments
+---------------------------------------------------------------------------------------
+PROGRAM
+---------------------------------------------------------------------------------------
+'''
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from os import environ
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+''' Module level variable '''
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+''' Uploaded files recorded in memory before the manifest is saved again, and the longest time between saves;
+    a run that dies in between uploads those files once more '''
+MANIFEST_SAVE_FILES = int(environ.get('TRANSFER_MANIFEST_SAVE_FILES', 100))
+MANIFEST_SAVE_SECONDS = float(environ.get('TRANSFER_MANIFEST_SAVE_SECONDS', 30))
+
+
+def iterFiles(dataDir):
+    ''' Walks a directory and its sub directories, yielding files as they are found
+        Only the names of the directories still to walk are kept in memory. With scandir, files and
+        directories are told apart from the directory entries on most file systems, and the size
+        costs one stat call per file; without scandir every entry is stat-ed up to four times
+
+    :param str dataDir: Directory path
+    :returns generator: (file path relative to dataDir, file size) pairs
+    :raises OSError: Error while reading a directory
+    '''
+    pendingDirs = ['']
+
+    while pendingDirs:
+        relativeDir = pendingDirs.pop()
+        currentDir = os.path.join(dataDir, relativeDir)
+
+        if scandir is not None:
+            for dirEntry in scandir(currentDir):
+                relativePath = os.path.join(relativeDir, dirEntry.name)
+                if dirEntry.is_dir(follow_symlinks=False):
+                    pendingDirs.append(relativePath)
+                elif dirEntry.is_file():
+                    yield relativePath, dirEntry.stat().st_size
+        else:
+            for fileNm in os.listdir(currentDir):
+                relativePath = os.path.join(relativeDir, fileNm)
+                filePath = os.path.join(currentDir, fileNm)
+                if os.path.isdir(filePath) and not os.path.islink(filePath):
+                    pendingDirs.append(relativePath)
+                elif os.path.isfile(filePath):
+                    yield relativePath, os.path.getsize(filePath)
+
+
+def computeMd5(filePath):
+    ''' Computes the MD5 of a file in one streaming pass
+
+    :param str filePath: File path
+    :returns str: base64 encoded MD5, same format as blob Content-MD5
+    :raises IOError: Error while reading the file
+    '''
+    md5 = hashlib.md5()
+
+    with open(filePath, 'rb') as fileIn:
+        for chunk in iter(lambda: fileIn.read(HASH_CHUNK_SIZE), b''):
+            md5.update(chunk)
+
+    return base64.b64encode(md5.digest())
+
+
+class TransferManifest():
+    ''' This class has methods for tracking the transfer of the files of one feed and date '''
+
+    def __init__(self, tempDataDir, executionDate, saveFiles=MANIFEST_SAVE_FILES, saveSeconds=MANIFEST_SAVE_SECONDS):
+        ''' Loads the manifest of the temp directory, if one exists for the same date
+
+        :param str tempDataDir: VM temp directory of the feed and date
+        :param date executionDate: Execution date
+        :param int saveFiles: Uploaded files recorded before the manifest is saved
+        :param float saveSeconds: Longest time uploaded files wait for a save
+        :returns:
+        :raises:
+        '''
+        self.LOGGER = logging.getLogger(__name__)
+        self.tempDataDir = tempDataDir
+        self.executionDate = executionDate.strftime('%Y-%m-%d')
+        self.manifestPath = tempDataDir.rstrip(os.sep) + '.manifest.json'
+
+        self.saveFiles = saveFiles
+        self.saveSeconds = saveSeconds
+
+        self._lock = threading.Lock()
+        self._unsavedUploads = 0
+        self._savedAt = time.time()
+        self._manifest = {'executionDate': self.executionDate, 'downloaded': False, 'files': {}}
+        ''' True, if an earlier run of the same date left its manifest '''
+        self.kept = False
+
+        if os.path.exists(self.manifestPath):
+            try:
+                with open(self.manifestPath) as manifestIn:
+                    manifest = json.load(manifestIn)
+            except (IOError, ValueError) as e:
+                self.LOGGER.warning("Ignoring unreadable manifest {}. {}".format(self.manifestPath, str(e)))
+            else:
+                if manifest.get('executionDate') == self.executionDate:
+                    self._manifest = manifest
+                    self.kept = True
+
+
+    def canResume(self):
+        ''' Checks if an earlier run downloaded all the files and they are still on the VM
+            Files are only checked against the manifest, not the source: a file corrected at the source
+            after the earlier download is not downloaded again, until the date succeeds or is cleaned up
+
+        :param:
+        :returns boolean: True, if the download can be skipped
+        :raises:
+        '''
+        if not self._manifest['downloaded'] or not self._manifest['files']:
+            return False
+
+        for fileNm, fileStat in self._manifest['files'].items():
+            filePath = os.path.join(self.tempDataDir, fileNm)
+            if not os.path.isfile(filePath) or os.path.getsize(filePath) != fileStat['size']:
+                return False
+
+        return True
+
+
+    def fileCount(self):
+        ''' Number of files in the manifest '''
+        return len(self._manifest['files'])
+
+
+    def recordDownload(self):
+        ''' Records size and checksum of the files in the temp directory
+            Files already uploaded with the same checksum stay marked as uploaded
+
+        :param:
+        :returns:
+        :raises IOError: Error while reading the files
+        '''
+        previousFiles = self._manifest['files']
+        files = {}
+
+        for fileNm, fileSize in iterFiles(self.tempDataDir):
+            md5 = computeMd5(os.path.join(self.tempDataDir, fileNm))
+            previous = previousFiles.get(fileNm, {})
+            files[fileNm] = {'size': fileSize,
+                             'md5': md5,
+                             'uploaded': previous.get('uploaded', False) and previous.get('md5') == md5}
+
+        with self._lock:
+            self._manifest['files'] = files
+            self._manifest['downloaded'] = True
+            self._save()
+
+
+    def uploadedFiles(self):
+        ''' Names of the files already uploaded to Azure
+
+        :param:
+        :returns set: file names
+        :raises:
+        '''
+        with self._lock:
+            return set(fileNm for fileNm, fileStat in self._manifest['files'].items() if fileStat['uploaded'])
+
+
+    def markUploaded(self, fileNm):
+        ''' Records a file as uploaded; the manifest is saved every saveFiles files or saveSeconds seconds
+
+        :param str fileNm: File name
+        :returns:
+        :raises IOError: Error while writing the manifest
+        '''
+        with self._lock:
+            if fileNm in self._manifest['files']:
+                self._manifest['files'][fileNm]['uploaded'] = True
+                self._unsavedUploads += 1
+                if self._unsavedUploads >= self.saveFiles or time.time() - self._savedAt >= self.saveSeconds:
+                    self._save()
+
+
+    def flush(self):
+        ''' Saves the uploaded files not saved yet, at the end of an upload
+
+        :param:
+        :returns:
+        :raises IOError: Error while writing the manifest
+        '''
+        with self._lock:
+            if self._unsavedUploads:
+                self._save()
+
+
+    def clearUploaded(self):
+        ''' Records all the files as not uploaded, once the partial upload is deleted from Azure
+
+        :param:
+        :returns:
+        :raises IOError: Error while writing the manifest
+        '''
+        with self._lock:
+            for fileStat in self._manifest['files'].values():
+                fileStat['uploaded'] = False
+            self._save()
+
+
+    def remove(self):
+        ''' Deletes the manifest, once the feed and date completed '''
+        if os.path.exists(self.manifestPath):
+            os.remove(self.manifestPath)
+
+
+    def _save(self):
+        ''' Writes the manifest to a temporary file and renames it, so it is never half written '''
+        tempPath = self.manifestPath + '.tmp'
+
+        with open(tempPath, 'w') as manifestOut:
+            json.dump(self._manifest, manifestOut)
+
+        os.rename(tempPath, self.manifestPath)
+        self._unsavedUploads = 0
+        self._savedAt = time.time()
@@ -0,0 +1,95 @@
+'''------------------------------------------------------------------------
+SUMMARY OF THE PROGRAM: This module records per-file transfer metrics
+It has methods to performs following action:
+    - Write one JSON line per file downloaded, uploaded or streamed
+    - Bytes, duration, throughput and retries, tagged with source, feed and date
+
+Lines are appended to TRANSFER_METRICS_FILE, one write per line, so several runs on
+the VM can share the file
+---------------------------------------------------------------------------------------
+VERSION        Date            Comments
+---------------------------------------------------------------------------------------
+PROGRAM
+---------------------------------------------------------------------------------------
+'''
+import datetime
+import json
+import logging
+import threading
+
+from os import environ
+
+''' Module level variable '''
+''' JSON-lines metrics file; blank disables the metrics '''
+METRICS_FILE = environ.get('TRANSFER_METRICS_FILE', '')
+
+MEGABYTE = 1024 * 1024
+
+
+class TransferMetrics():
+    ''' This class has methods for writing transfer metrics to a JSON-lines file '''
+
+    def __init__(self, metricsFile=METRICS_FILE):
+        ''' Keeps the metrics file path
+
+        :param str metricsFile: Metrics file path; blank disables the metrics
+        :returns:
+        :raises:
+        '''
+        self.LOGGER = logging.getLogger(__name__)
+        self.metricsFile = metricsFile
+        self._lock = threading.Lock()
+
+
+    def isEnabled(self):
+        ''' Checks if a metrics file is configured '''
+        return bool(self.metricsFile)
+
+
+    def record(self, direction, fileNm, byteCount, seconds, retries=0, status='SUCCESS', **tags):
+        ''' Appends the metrics of one file
+
+        :param str direction: 'download', 'upload' or 'stream'
+        :param str fileNm: File name
+        :param int byteCount: Bytes transferred
+        :param float seconds: Duration of the transfer
+        :param int retries: Retries of the transfer
+        :param str status: SUCCESS, FAILED or SKIPPED
+        :param tags: sourceNm, feedId, executionDate and other tags of the record
+        :returns:
+        :raises:
+        '''
+        if not self.metricsFile:
+            return
+
+        metrics = {'time': datetime.datetime.utcnow().isoformat(),
+                   'direction': direction,
+                   'fileNm': fileNm,
+                   'bytes': byteCount,
+                   'seconds': round(seconds, 3),
+                   'mbPerSecond': round(float(byteCount) / MEGABYTE / seconds, 3) if seconds > 0 else None,
+                   'retries': retries,
+                   'status': status}
+        metrics.update(tags)
+
+        ''' metrics never fail a transfer '''
+        try:
+            with self._lock:
+                with open(self.metricsFile, 'a') as metricsOut:
+                    metricsOut.write(json.dumps(metrics, default=str) + '\n')
+        except (IOError, OSError) as e:
+            self.LOGGER.warning("Cannot write transfer metrics to {}. {}".format(self.metricsFile, str(e)))
+
+
+''' Process wide metrics writer shared by getfiles and AzureLoad '''
+_metrics = TransferMetrics()
+
+
+def isEnabled():
+    ''' Checks if the process wide metrics are enabled, see TransferMetrics.isEnabled '''
+    return _metrics.isEnabled()
+
+
+def record(direction, fileNm, byteCount, seconds, retries=0, status='SUCCESS', **tags):
+    ''' Appends the metrics of one file, see TransferMetrics.record '''
+    _metrics.record(direction, fileNm, byteCount, seconds, retries, status, **tags)